@@ -37,6 +37,22 @@ const uploadToCloudinary = (file, modelFolder) => {
   });
 };
 
+// Poll the Python server until a queued training job finishes
+const waitForTrainingJob = async (jobId, intervalMs = 5000) => {
+  while (true) {
+    const { data } = await axios.get(`${python_api_url}/train/${jobId}`);
+    if (data.status === 'succeeded') {
+      return data;
+    }
+    if (data.status === 'failed') {
+      const err = new Error(data.error || 'Training failed');
+      err.response = { status: 500, data };
+      throw err;
+    }
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+  }
+};
+
 const handleTrainNewModel = async (req, res) => {
   const { default: pLimit } = await import('p-limit');
 const limit = pLimit(19);
@@ -108,16 +124,13 @@ const limit = pLimit(19);
     // Optionally, you can filter out classes with no valid images here
     // Now proceed with training
     console.log("Trying to train with model name:", modelNameWithUniqueId);
-    const response = await axios.post(`${python_api_url}/train`, {
+    const jobResponse = await axios.post(`${python_api_url}/train`, {
       modelName: modelNameWithUniqueId,
       classes: classNames,
       modelArch,
-    } ,
-    {
-      timeout: 0,               // disable timeout
-      maxContentLength: Infinity,
-      maxBodyLength: Infinity,  // if you’re sending/receiving large payloads
     });
+    console.log("Training job queued:", jobResponse.data.jobId);
+    const response = { data: await waitForTrainingJob(jobResponse.data.jobId) };
     const modelPath = response.data.modelPath;
     const cloudPath = response.data.cloudPath;
     
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+
+# Bucket a queue depth into a power-of-two histogram bin ("1", "2", "4", ...)
+def _depth_bucket(depth: int) -> str:
+    bucket = 1
+    while bucket < depth:
+        bucket *= 2
+    return str(bucket)
+
+
+# Dynamic micro-batcher.
+#
+# Items submitted under the same key (e.g. a model identity) are coalesced
+# into one call of run_batch(key, items), which must return one result per
+# item in the same order. A batch is dispatched as soon as max_batch_size
+# items are waiting or the oldest waiting item has been queued for
+# max_wait_ms. Each key gets its own dispatcher thread, so different models
+# never block each other; idle dispatchers exit after idle_timeout seconds.
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0, idle_timeout: float = 60.0):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        self._queues = {}   # key -> deque of (item, future, enqueued_at)
+        self._workers = {}  # key -> dispatcher thread
+        self.batch_sizes = Counter()
+        self.queue_depths = Counter()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, key, item) -> Future:
+        future = Future()
+        with self._cond:
+            queue = self._queues.setdefault(key, deque())
+            queue.append((item, future, time.monotonic()))
+            self.queue_depths[_depth_bucket(len(queue))] += 1
+            if key not in self._workers:
+                worker = threading.Thread(target=self._dispatch, args=(key,),
+                                          name="batcher", daemon=True)
+                self._workers[key] = worker
+                worker.start()
+            self._cond.notify_all()
+        return future
+
+    def _next_batch(self, key):
+        with self._cond:
+            queue = self._queues[key]
+            idle_since = time.monotonic()
+            while not queue:
+                remaining = self.idle_timeout - (time.monotonic() - idle_since)
+                if remaining <= 0:
+                    del self._queues[key]
+                    del self._workers[key]
+                    return None
+                self._cond.wait(remaining)
+
+            deadline = queue[0][2] + self.max_wait
+            while len(queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [queue.popleft() for _ in range(min(len(queue), self.max_batch_size))]
+            self.batch_sizes[len(batch)] += 1
+            self.batches += 1
+            self.items += len(batch)
+            return batch
+
+    def _dispatch(self, key):
+        while True:
+            batch = self._next_batch(key)
+            if batch is None:
+                return
+            futures = [f for _, f, _ in batch]
+            try:
+                results = self.run_batch(key, [item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"run_batch returned {len(results)} results for {len(batch)} items"
+                    )
+            except BaseException as e:
+                for f in futures:
+                    f.set_exception(e)
+                continue
+            for f, result in zip(futures, results):
+                f.set_result(result)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'queue_depth': sum(len(q) for q in self._queues.values()),
+                'active_keys': len(self._workers),
+                'batches': self.batches,
+                'items': self.items,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self.batch_sizes.items())},
+                'queue_depth_histogram': dict(sorted(self.queue_depths.items(), key=lambda kv: int(kv[0]))),
+            }
@@ -0,0 +1,96 @@
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+import classify_image
+from classify_image import build_model
+from inference_engine import InferenceEngine
+from model_artifacts import SCRIPT_SUFFIX, export_torchscript, sibling_path
+from weight_cache import WeightCache
+from benchmarks.fakes import FakeStorageClient
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+# Save a randomly initialised model of `arch` locally and to the fake GCS
+# bucket, the same way save_model lays out trained models
+def publish_model(arch: str, num_classes: int, storage, workdir: str):
+    torch.manual_seed(0)
+    model = build_model(arch, num_classes)
+    local_path = os.path.join(workdir, f'{arch}.pth')
+    torch.save(model.state_dict(), local_path)
+    bucket = storage.bucket('ptm_models')
+    bucket.blob(f'models/{arch}.pth').upload_from_filename(local_path)
+    script_path = export_torchscript(model, sibling_path(local_path, SCRIPT_SUFFIX))
+    bucket.blob(f'models/{arch}{SCRIPT_SUFFIX}').upload_from_filename(script_path)
+    return local_path, f'gs://ptm_models/models/{arch}.pth'
+
+
+# Cold and warm /classify latency plus throughput at several concurrency
+# levels for one architecture, going through the same InferenceEngine the
+# server uses, with GCS replaced by FakeStorageClient and images served by
+# a SyntheticImageServer.
+def bench_classify(arch: str, image_server, workdir: str, num_classes: int = 5,
+                   concurrency_levels=(1, 4, 16), requests_per_level: int = 64,
+                   warm_requests: int = 10, engine_options=None):
+    storage = FakeStorageClient()
+    local_path, cloud_path = publish_model(arch, num_classes, storage, workdir)
+    classify_image.weight_cache = WeightCache(os.path.join(workdir, f'weights-{arch}'), client=storage)
+    classify_image.model_cache.clear()
+    engine = InferenceEngine(**(engine_options or {}))
+
+    # every request uses a distinct image so nothing is served from a cache
+    image_ids = itertools.count()
+
+    def classify_one():
+        i = next(image_ids)
+        url = image_server.url(i % num_classes, i)
+        start = time.perf_counter()
+        engine.classify(url, local_path, cloud_path, arch, num_classes)
+        return time.perf_counter() - start
+
+    try:
+        cold = classify_one()
+        warm = [classify_one() for _ in range(warm_requests)]
+
+        levels = []
+        for concurrency in concurrency_levels:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = list(pool.map(lambda _: classify_one(), range(requests_per_level)))
+            elapsed = time.perf_counter() - start
+            levels.append({
+                'concurrency': concurrency,
+                'requests': requests_per_level,
+                'throughput_rps': requests_per_level / elapsed,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+            })
+            print(f'  {arch} c={concurrency}: {levels[-1]["throughput_rps"]:.1f} req/s, '
+                  f'p50 {levels[-1]["p50_ms"]:.1f} ms, p99 {levels[-1]["p99_ms"]:.1f} ms')
+        batcher = engine.stats()
+    finally:
+        engine.shutdown()
+
+    return {
+        'arch': arch,
+        'cold_ms': cold * 1000,
+        'warm_p50_ms': percentile(warm, 50) * 1000,
+        'warm_p99_ms': percentile(warm, 99) * 1000,
+        'levels': levels,
+        'batch_size_histogram': batcher['batch_size_histogram'],
+        'gcs': {
+            'metadata_requests': storage.metadata_requests,
+            'downloads': storage.downloads,
+            'bytes_downloaded': storage.bytes_downloaded,
+        },
+    }
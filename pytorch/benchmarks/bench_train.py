@@ -0,0 +1,60 @@
+import json
+import os
+import time
+
+import torch.nn as nn
+import torch.optim as optim
+
+import train_model as tm
+from image_cache import ImageCache
+from progress import ProgressReporter
+
+
+# Train `arch` for a fixed number of epochs on synthetic images served by
+# `image_server` and report images/sec and DataLoader stall time per epoch,
+# taken from the progress events train_model emits. The backbone is
+# randomly initialised so no pretrained weights need downloading.
+def bench_train(arch: str, image_server, workdir: str, num_classes: int = 3,
+                per_class: int = 40, epochs: int = 2, tensor_store: bool = False):
+    tm.TENSOR_STORE_DIR = os.path.join(workdir, 'tensor_stores')
+    tm.FEATURE_CACHE_DIR = os.path.join(workdir, 'features')
+    image_urls = image_server.image_urls(num_classes, per_class)
+    image_cache = ImageCache(os.path.join(workdir, 'images'))
+    events_path = os.path.join(workdir, f'train-{arch}{"-store" if tensor_store else ""}.ndjson')
+
+    model = tm.setup_model(arch, num_classes, pretrained=False)
+    optimizer = optim.Adam(model.parameters(), lr=0.001)
+    progress = ProgressReporter(events_path)
+    start = time.perf_counter()
+    try:
+        tm.train_model(model, image_urls, nn.CrossEntropyLoss(), optimizer,
+                       target_accuracy=1.01, image_cache=image_cache,
+                       use_tensor_store=tensor_store, progress=progress,
+                       progress_every=0, max_epochs=epochs)
+    finally:
+        progress.close()
+    total = time.perf_counter() - start
+
+    epoch_events, stages = [], {}
+    with open(events_path, 'r') as f:
+        for line in f:
+            event = json.loads(line)
+            if event['type'] == 'epoch':
+                epoch_events.append(event)
+            elif event['type'] == 'stage':
+                stages[event['stage']] = stages.get(event['stage'], 0.0) + event['seconds']
+
+    return {
+        'arch': arch,
+        'tensor_store': tensor_store,
+        'images': num_classes * per_class,
+        'epochs': [{
+            'epoch': e['epoch'],
+            'images_per_sec': e['images_per_sec'],
+            'data_time': e['data_time'],
+            'compute_time': e['compute_time'],
+            'stall_fraction': e['data_time'] / max(e['data_time'] + e['compute_time'], 1e-9),
+        } for e in epoch_events],
+        'stages': stages,
+        'total_s': total,
+    }
@@ -0,0 +1,61 @@
+import argparse
+import json
+
+
+def _delta(old, new, higher_is_better: bool) -> str:
+    if not old:
+        return 'n/a'
+    change = (new - old) / old * 100.0
+    better = change > 0 if higher_is_better else change < 0
+    return f'{change:+.1f}%{" (better)" if better and abs(change) >= 1 else ""}'
+
+
+# Flatten a results file into {metric name: (value, higher_is_better)}
+def flatten(results):
+    rows = {}
+    for r in results.get('classify', []):
+        arch = r['arch']
+        rows[f'classify/{arch}/cold_ms'] = (r['cold_ms'], False)
+        rows[f'classify/{arch}/warm_p50_ms'] = (r['warm_p50_ms'], False)
+        for level in r['levels']:
+            c = level['concurrency']
+            rows[f'classify/{arch}/c{c}/throughput_rps'] = (level['throughput_rps'], True)
+            rows[f'classify/{arch}/c{c}/p50_ms'] = (level['p50_ms'], False)
+            rows[f'classify/{arch}/c{c}/p99_ms'] = (level['p99_ms'], False)
+    for r in results.get('train', []):
+        name = f"train/{r['arch']}{'/store' if r['tensor_store'] else ''}"
+        epochs = r['epochs']
+        if epochs:
+            # the last epoch is steady state: caches warm, workers started
+            rows[f'{name}/images_per_sec'] = (epochs[-1]['images_per_sec'], True)
+            rows[f'{name}/stall_fraction'] = (epochs[-1]['stall_fraction'], False)
+        rows[f'{name}/total_s'] = (r['total_s'], False)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    old_rows, new_rows = flatten(baseline), flatten(candidate)
+
+    print(f"baseline {baseline['meta']['revision']}  vs  candidate {candidate['meta']['revision']}")
+    width = max((len(k) for k in old_rows.keys() | new_rows.keys()), default=10)
+    print(f"{'metric':<{width}}  {'baseline':>12}  {'candidate':>12}  change")
+    for name in sorted(old_rows.keys() | new_rows.keys()):
+        old = old_rows.get(name, (None, True))
+        new = new_rows.get(name, (None, True))
+        if old[0] is None or new[0] is None:
+            print(f"{name:<{width}}  {str(old[0]):>12}  {str(new[0]):>12}  n/a")
+            continue
+        print(f"{name:<{width}}  {old[0]:>12.3f}  {new[0]:>12.3f}  {_delta(old[0], new[0], new[1])}")
+
+
+if __name__ == '__main__':
+    main()
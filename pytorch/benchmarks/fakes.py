@@ -0,0 +1,312 @@
+import base64
+import hashlib
+import io
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import google_crc32c
+except ImportError:  # optional, only needed to check crc32c checksums
+    google_crc32c = None
+
+
+# Deterministic JPEG for (class index, image index): a class-specific base
+# colour plus noise, so a model can actually learn to separate classes
+def synthetic_jpeg(cls: int, idx: int, width: int = 640, height: int = 480, quality: int = 90) -> bytes:
+    # imported here so the storage and Cloudinary fakes work without them
+    import numpy as np
+    from PIL import Image
+    rng = np.random.default_rng(cls * 1_000_003 + idx)
+    base = np.array([(cls * 67) % 256, (cls * 131 + 80) % 256, (cls * 29 + 160) % 256], dtype=np.float32)
+    pixels = base + rng.normal(0, 40, size=(height, width, 3))
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB')
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+
+# Local HTTP server standing in for Cloudinary delivery URLs.
+# GET /img/<cls>/<idx>.jpg returns a synthetic JPEG; responses are memoized.
+class SyntheticImageServer:
+    def __init__(self, width: int = 640, height: int = 480, latency: float = 0.0):
+        self.width = width
+        self.height = height
+        self.latency = latency
+        self.requests = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def _image(self, cls: int, idx: int) -> bytes:
+        with self._lock:
+            self.requests += 1
+            data = self._cache.get((cls, idx))
+        if data is None:
+            data = synthetic_jpeg(cls, idx, self.width, self.height)
+            with self._lock:
+                self._cache[(cls, idx)] = data
+        return data
+
+    def start(self) -> str:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                try:
+                    if len(parts) != 3 or parts[0] != 'img':
+                        raise ValueError(self.path)
+                    data = server._image(int(parts[1]), int(parts[2].split('.')[0]))
+                except ValueError:
+                    self.send_error(404)
+                    return
+                if server.latency:
+                    threading.Event().wait(server.latency)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def url(self, cls: int, idx: int) -> str:
+        return f'{self.base_url}/img/{cls}/{idx}.jpg'
+
+    # {class name: [urls]} in the shape get_image_urls_from_cloudinary returns
+    def image_urls(self, num_classes: int, per_class: int):
+        return {f'class_{c}': [self.url(c, i) for i in range(per_class)] for c in range(num_classes)}
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# In-memory stand-in for google.cloud.storage.Client, implementing the
+# subset of the blob API this project uses. It counts metadata requests,
+# downloads and bytes so benchmarks can report network work.
+class FakeStorageClient:
+    def __init__(self):
+        self._objects = {}  # (bucket, name) -> {'data', 'generation', ...}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.metadata_requests = 0
+        self.downloads = 0
+        self.bytes_downloaded = 0
+
+    def bucket(self, name: str):
+        return FakeBucket(self, name)
+
+    def _put(self, bucket: str, name: str, data: bytes):
+        with self._lock:
+            self._generation += 1
+            self._objects[(bucket, name)] = {
+                'data': data,
+                'generation': self._generation,
+                'md5_hash': base64.b64encode(hashlib.md5(data).digest()).decode('ascii'),
+                'crc32c': (base64.b64encode(google_crc32c.Checksum(data).digest()).decode('ascii')
+                           if google_crc32c else None),
+            }
+
+    def _get(self, bucket: str, name: str):
+        with self._lock:
+            return self._objects.get((bucket, name))
+
+
+class FakeBucket:
+    def __init__(self, client: FakeStorageClient, name: str):
+        self.client = client
+        self.name = name
+
+    def blob(self, name: str):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str):
+        self.client.metadata_requests += 1
+        if self.client._get(self.name, name) is None:
+            return None
+        blob = FakeBlob(self, name)
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix: str = ''):
+        with self.client._lock:
+            names = [n for b, n in self.client._objects if b == self.name and n.startswith(prefix)]
+        return [self.get_blob(n) for n in sorted(names)]
+
+
+class FakeBlob:
+    def __init__(self, bucket: FakeBucket, name: str):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = None
+        self.generation = None
+        self.md5_hash = None
+        self.crc32c = None
+        self.size = None
+
+    def _object(self):
+        obj = self.bucket.client._get(self.bucket.name, self.name)
+        if obj is None:
+            raise FileNotFoundError(f'gs://{self.bucket.name}/{self.name}')
+        return obj
+
+    def exists(self, **kwargs) -> bool:
+        self.bucket.client.metadata_requests += 1
+        return self.bucket.client._get(self.bucket.name, self.name) is not None
+
+    def reload(self, **kwargs):
+        obj = self._object()
+        self.generation = obj['generation']
+        self.md5_hash = obj['md5_hash']
+        self.crc32c = obj['crc32c']
+        self.size = len(obj['data'])
+
+    def download_as_bytes(self, start=None, end=None, **kwargs) -> bytes:
+        data = self._object()['data']
+        # GCS byte ranges are inclusive of `end`
+        data = data[start or 0:(end + 1) if end is not None else None]
+        client = self.bucket.client
+        with client._lock:
+            client.downloads += 1
+            client.bytes_downloaded += len(data)
+        return data
+
+    def download_to_file(self, file_obj, start=None, end=None, **kwargs):
+        file_obj.write(self.download_as_bytes(start=start, end=end))
+
+    def download_to_filename(self, filename, start=None, end=None, **kwargs):
+        with open(filename, 'wb') as f:
+            self.download_to_file(f, start=start, end=end)
+
+    def upload_from_string(self, data, **kwargs):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.bucket.client._put(self.bucket.name, self.name, bytes(data))
+        self.reload()
+
+    def upload_from_file(self, file_obj, **kwargs):
+        self.upload_from_string(file_obj.read())
+
+    def upload_from_filename(self, filename, **kwargs):
+        with open(filename, 'rb') as f:
+            self.upload_from_string(f.read())
+
+    def compose(self, sources, **kwargs):
+        if len(sources) > 32:
+            raise ValueError(f'compose takes at most 32 sources, got {len(sources)}')
+        self.upload_from_string(b''.join(s._object()['data'] for s in sources))
+
+    def delete(self, **kwargs):
+        with self.bucket.client._lock:
+            self.bucket.client._objects.pop((self.bucket.name, self.name), None)
+
+
+class FakeRateLimited(Exception):
+    pass
+
+
+# In-memory stand-in for the Cloudinary Admin and Search APIs, with the
+# interface of cloudinary_listing.CloudinaryApi. Every request is counted
+# and can be slowed down by `latency`; with rate_limit_every=N every Nth
+# request fails with FakeRateLimited.
+class FakeCloudinaryApi:
+    rate_limit_errors = (FakeRateLimited,)
+
+    def __init__(self, latency: float = 0.0, rate_limit_every: int = 0):
+        self._resources = {}  # public_id -> resource dict
+        self._unindexed = set()  # public_ids search doesn't return yet
+        self._lock = threading.Lock()
+        self._clock = 1_700_000_000_000
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.calls = 0
+
+    # Upload {class: [urls]} under dataset/<model_name>/<class>/, named like
+    # the backend names uploads: <ms timestamp>_<file name>. With
+    # indexed=False, search doesn't see them until index() is called.
+    def add_images(self, model_name: str, image_urls, nbytes: int = 50_000,
+                   width: int = 640, height: int = 480, indexed: bool = True):
+        with self._lock:
+            for cls, urls in image_urls.items():
+                for url in urls:
+                    self._clock += 1
+                    public_id = f'dataset/{model_name}/{cls}/{self._clock}_{url.rsplit("/", 1)[-1]}'
+                    self._resources[public_id] = {
+                        'public_id': public_id,
+                        'secure_url': url,
+                        'bytes': nbytes,
+                        'etag': hashlib.md5(url.encode('utf-8')).hexdigest(),
+                        'width': width,
+                        'height': height,
+                        'format': 'jpg',
+                        'created_at': f'{self._clock}',
+                    }
+                    if not indexed:
+                        self._unindexed.add(public_id)
+
+    def index(self):
+        with self._lock:
+            self._unindexed.clear()
+
+    def remove(self, public_id: str):
+        with self._lock:
+            self._resources.pop(public_id, None)
+
+    def _request(self):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_limit_every and calls % self.rate_limit_every == 0:
+            raise FakeRateLimited('Rate Limit Exceeded')
+
+    def _page(self, ids, max_results: int, next_cursor: str = None):
+        start = int(next_cursor or 0)
+        end = start + max_results
+        with self._lock:
+            page = [dict(self._resources[i]) for i in ids[start:end] if i in self._resources]
+        return {'resources': page, 'next_cursor': str(end) if end < len(ids) else None}
+
+    # Newest created first by default, like the Admin API
+    def resources(self, type: str = 'upload', prefix: str = '', max_results: int = 10,
+                  next_cursor: str = None, direction: str = 'desc', **kwargs):
+        self._request()
+        with self._lock:
+            ids = sorted((i for i in self._resources if i.startswith(prefix)),
+                         reverse=direction in ('desc', -1))
+        return self._page(ids, max_results, next_cursor)
+
+    # Only the public_id:<escaped prefix>* expressions cloudinary_listing sends
+    def search(self, expression: str, max_results: int = 50, next_cursor: str = None):
+        self._request()
+        prefix = re.sub(r'\\(.)', r'\1', expression[len('public_id:'):-1])
+        with self._lock:
+            ids = sorted((i for i in self._resources
+                          if i.startswith(prefix) and i not in self._unindexed), reverse=True)
+        return self._page(ids, max_results, next_cursor)
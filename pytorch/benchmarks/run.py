@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import torch
+
+from benchmarks.bench_classify import bench_classify
+from benchmarks.bench_train import bench_train
+from benchmarks.fakes import SyntheticImageServer
+
+ARCHS = ('resnet50', 'googlenet', 'mobilenet_v2')
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Offline benchmarks for the classify and train paths. '
+                    'Run from the pytorch/ directory: python -m benchmarks.run')
+    parser.add_argument('--archs', default=','.join(ARCHS))
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='comma-separated concurrency levels for /classify throughput')
+    parser.add_argument('--requests', type=int, default=64,
+                        help='requests per concurrency level')
+    parser.add_argument('--workers', type=int, default=4, help='inference engine workers')
+    parser.add_argument('--batch-size', type=int, default=16, help='micro-batch max size')
+    parser.add_argument('--batch-wait-ms', type=float, default=5.0, help='micro-batch max wait')
+    parser.add_argument('--image-size', default='640x480', help='synthetic image WxH')
+    parser.add_argument('--image-latency-ms', type=float, default=0.0,
+                        help='artificial latency added by the image server')
+    parser.add_argument('--train-epochs', type=int, default=2)
+    parser.add_argument('--train-images', type=int, default=40, help='training images per class')
+    parser.add_argument('--skip-classify', action='store_true')
+    parser.add_argument('--skip-train', action='store_true')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args(argv)
+
+    archs = [a for a in args.archs.split(',') if a]
+    levels = [int(c) for c in args.concurrency.split(',') if c]
+    width, height = (int(v) for v in args.image_size.lower().split('x'))
+    torch.manual_seed(0)
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'args': vars(args),
+        },
+        'classify': [],
+        'train': [],
+    }
+
+    with tempfile.TemporaryDirectory(prefix='ptm-bench-') as workdir, \
+            SyntheticImageServer(width, height, latency=args.image_latency_ms / 1000.0) as images:
+        if not args.skip_classify:
+            for arch in archs:
+                print(f'Benchmarking classify: {arch}')
+                results['classify'].append(bench_classify(
+                    arch, images, workdir, concurrency_levels=levels,
+                    requests_per_level=args.requests,
+                    engine_options={'workers': args.workers,
+                                    'max_batch_size': args.batch_size,
+                                    'max_wait_ms': args.batch_wait_ms}))
+        if not args.skip_train:
+            for arch in archs:
+                for tensor_store in (False, True):
+                    print(f'Benchmarking train: {arch}{" (tensor store)" if tensor_store else ""}')
+                    results['train'].append(bench_train(
+                        arch, images, workdir, per_class=args.train_images,
+                        epochs=args.train_epochs, tensor_store=tensor_store))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+    return results
+
+
+if __name__ == '__main__':
+    main()
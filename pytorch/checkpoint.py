@@ -0,0 +1,39 @@
+import os
+import random
+
+import torch
+
+
+# Detached CPU copy of a module's weights. state_dict() alone returns
+# references to the live tensors, which later optimizer steps overwrite.
+def snapshot_state_dict(module):
+    return {k: v.detach().to('cpu', copy=True) for k, v in module.state_dict().items()}
+
+
+def rng_state():
+    state = {'python': random.getstate(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+# Write a checkpoint dict atomically: a crash mid-write leaves the previous
+# checkpoint in place rather than a truncated file
+def save_checkpoint(path: str, state: dict):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str, map_location='cpu'):
+    if not path or not os.path.exists(path):
+        return None
+    return torch.load(path, map_location=map_location)
@@ -1,19 +1,23 @@
 import sys
 import os
-import io
 import json
-from io import BytesIO
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 import numpy as np
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import torch
 import torch.nn as nn
-from torchvision import models, transforms
-from PIL import Image
-from google.cloud import storage
+from torchvision import models
+
+from image_fetcher import ImageFetcher
+from model_artifacts import INT8_SUFFIX, SCRIPT_SUFFIX, sibling_path
+from model_cache import ModelCache
+from result_cache import ResultCache
+from preprocessing import decode_image, normalize_batch, resize_center_crop
+from weight_cache import WeightCache
+from metrics import CLASSIFY_STAGE_SECONDS, timed
 
 # Load environment variables
 load_dotenv()
@@ -24,26 +28,55 @@ if os.getenv("GCP_KEY_JSON"):
         f.write(os.getenv("GCP_KEY_JSON"))
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "gcs-key.json"
 
-# Configure HTTP session with retries
-session = requests.Session()
-retry = Retry(total=5, backoff_factor=1,
-              status_forcelist=[429, 500, 502, 503, 504],
-              allowed_methods=["GET"])
-adapter = HTTPAdapter(max_retries=retry)
-session.mount('https://', adapter)
-
-# Preprocessing transforms (must match training val_transform)
-preprocess = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                         std=[0.229, 0.224, 0.225]),
-])
+# Image downloads: pooled per host, coalesced, size-capped and bounded by
+# an overall deadline (retries included), with a short-lived bytes cache
+image_fetcher = ImageFetcher(
+    per_host=int(os.getenv("IMAGE_FETCH_PER_HOST", "8")),
+    max_bytes=int(os.getenv("IMAGE_MAX_MB", "20")) * 1024 * 1024,
+    timeout=float(os.getenv("IMAGE_FETCH_TIMEOUT", "10")),
+    deadline=float(os.getenv("IMAGE_FETCH_DEADLINE", "20")),
+    cache_ttl=float(os.getenv("IMAGE_CACHE_TTL", "60")),
+    cache_max_bytes=int(os.getenv("IMAGE_CACHE_MB", "64")) * 1024 * 1024,
+)
+
+# Built models kept in memory between requests (budget in MB of parameters)
+model_cache = ModelCache(max_bytes=int(os.getenv("MODEL_CACHE_MB", "1024")) * 1024 * 1024)
+
+# Classification results per (model weights, image URL or content hash)
+result_cache = ResultCache(max_entries=int(os.getenv("RESULT_CACHE_ENTRIES", "10000")),
+                           ttl=float(os.getenv("RESULT_CACHE_TTL", "3600")))
+
+# Weight files downloaded from GCS, reused across requests and restarts
+weight_cache = WeightCache(
+    cache_dir=os.getenv("WEIGHT_CACHE_DIR",
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "weights")),
+    max_bytes=int(os.getenv("WEIGHT_CACHE_MB", "4096")) * 1024 * 1024,
+    ttl=float(os.getenv("WEIGHT_CACHE_TTL", "300")),
+    transfer_workers=int(os.getenv("GCS_TRANSFER_WORKERS", "8")),
+)
 
 def log(msg: str):
     print(msg, file=sys.stderr)
 
+# Weight files read by the model load running on this thread (see get_model)
+_load_sources = threading.local()
+# Model cache key -> digest of the weight files the resident model came from
+model_digests = {}
+
+def _note_source(path: str):
+    paths = getattr(_load_sources, "paths", None)
+    if paths is not None:
+        paths.append(path)
+
+# Identity of a set of weight files. GCS copies live in the content-addressed
+# weight cache; a local file rewritten by save_model gets a new mtime.
+def weight_digest(paths) -> str:
+    h = hashlib.sha256()
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
 # Load model weights from GCS if valid, else local
 def load_model_from_path(model, local_path: str, cloud_path: str):
     log("\n=== Model Loading Process ===")
@@ -54,21 +87,15 @@ def load_model_from_path(model, local_path: str, cloud_path: str):
     if isinstance(cloud_path, str) and cloud_path.startswith("gs://"):
         try:
             log(f"Attempting to load from GCS: {cloud_path}")
-            parts = cloud_path.replace("gs://", "").split("/")
-            bucket_name = parts[0]
-            blob_name = "/".join(parts[1:])
-            client = storage.Client()
-            bucket = client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
-            if blob.exists():
-                buffer = io.BytesIO()
-                blob.download_to_file(buffer)
-                buffer.seek(0)
-                model.load_state_dict(torch.load(buffer, map_location='cpu'))
-                log("Model loaded from GCS successfully")
-                return model
-            else:
-                log("Blob not found in GCS, falling back to local path")
+            with timed(CLASSIFY_STAGE_SECONDS, "weight_fetch", source="gcs"):
+                cached_path = weight_cache.fetch(cloud_path)
+            with timed(CLASSIFY_STAGE_SECONDS, "torch_load", source="gcs"):
+                model.load_state_dict(torch.load(cached_path, map_location='cpu'))
+            _note_source(cached_path)
+            log("Model loaded from GCS successfully")
+            return model
+        except FileNotFoundError:
+            log("Blob not found in GCS, falling back to local path")
         except Exception as e:
             log(f"Error loading from GCS: {e}")
             log("Falling back to local path...")
@@ -77,27 +104,24 @@ def load_model_from_path(model, local_path: str, cloud_path: str):
         log(f"Attempting to load from local path: {local_path}")
         if not local_path or not os.path.exists(local_path):
             raise FileNotFoundError("Local model file not found")
-        model.load_state_dict(torch.load(local_path, map_location='cpu'))
+        with timed(CLASSIFY_STAGE_SECONDS, "torch_load", source="local"):
+            model.load_state_dict(torch.load(local_path, map_location='cpu'))
+        _note_source(local_path)
         log("Model loaded from local path successfully")
         return model
     except Exception as e:
         log(f"Error loading from local path: {e}")
         raise FileNotFoundError("Failed to load model from both GCS and local paths")
 
-# Main classification function
-def classify_image(image_url: str, local_path: str, cloud_path: str,
-                   model_arch: str, classes_length: int):
-    log("\n=== Starting Classification Process ===")
-    log(f"Image URL: {image_url}")
-    log(f"Model architecture: {model_arch}")
-    log(f"Number of classes: {classes_length}")
-
-    # Build model skeleton
-    log("\nSetting up model architecture...")
+# Build model skeleton with a fresh head for the given number of classes
+def build_model(model_arch: str, classes_length: int):
     if model_arch == "resnet50":
         model = models.resnet50(pretrained=False)
     elif model_arch == "googlenet":
-        model = models.googlenet(weights=models.GoogLeNet_Weights.IMAGENET1K_V1)
+        # Same layout as the pretrained model used for training (no aux heads,
+        # transform_input on) without downloading ImageNet weights we'd overwrite
+        model = models.googlenet(weights=None, aux_logits=False, init_weights=False,
+                                 transform_input=True)
     elif model_arch == "mobilenet_v2":
         model = models.mobilenet_v2(pretrained=False)
     else:
@@ -110,30 +134,119 @@ def classify_image(image_url: str, local_path: str, cloud_path: str,
         model.classifier[1] = nn.Linear(
             model.classifier[1].in_features, classes_length
         )
+    return model
+
+# Load an artifact stored next to the model's .pth (GCS first, then local)
+# with `loader`, timed as torch_load under `source`; returns None when
+# neither copy exists
+def load_artifact(local_path: str, cloud_path: str, suffix: str, loader, source: str):
+    if isinstance(cloud_path, str) and cloud_path.startswith("gs://"):
+        try:
+            with timed(CLASSIFY_STAGE_SECONDS, "weight_fetch", source="gcs"):
+                cached_path = weight_cache.fetch(sibling_path(cloud_path, suffix))
+            with timed(CLASSIFY_STAGE_SECONDS, "torch_load", source=source):
+                model = loader(cached_path)
+            _note_source(cached_path)
+            return model
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log(f"Error loading {suffix} artifact from GCS: {e}")
+    if local_path and os.path.exists(sibling_path(local_path, suffix)):
+        with timed(CLASSIFY_STAGE_SECONDS, "torch_load", source=source):
+            model = loader(sibling_path(local_path, suffix))
+        _note_source(sibling_path(local_path, suffix))
+        return model
+    return None
+
+# Load the TorchScript export saved next to the .pth when there is one;
+# otherwise build the skeleton, load trained weights and switch to eval mode
+def load_model(local_path: str, cloud_path: str, model_arch: str, classes_length: int):
+    model = load_artifact(local_path, cloud_path, SCRIPT_SUFFIX,
+                          lambda path: torch.jit.load(path, map_location="cpu"), source="torchscript")
+    if model is not None:
+        log("Loaded TorchScript model")
+        return model.eval()
+
+    log("\nSetting up model architecture...")
+    with timed(CLASSIFY_STAGE_SECONDS, "model_build"):
+        model = build_model(model_arch, classes_length)
     log(f"Model skeleton created with {classes_length} outputs")
 
-    # Load weights and set to eval
     model = load_model_from_path(model, local_path, cloud_path)
     model.eval()
     log("Model set to evaluation mode")
+    return model
+
+# Optimized inference model: the int8 TorchScript artifact written at
+# training time when there is one, else the fp32 model in channels_last
+def load_optimized_model(local_path: str, cloud_path: str, model_arch: str, classes_length: int):
+    from quantize import select_quantized_engine
+    select_quantized_engine()
+    model = load_artifact(local_path, cloud_path, INT8_SUFFIX,
+                          lambda path: torch.jit.load(path, map_location="cpu"), source="int8")
+    if model is not None:
+        log("Loaded int8 model")
+        return model.eval()
+    log("No int8 model found, using fp32 in channels_last")
+    model = load_model(local_path, cloud_path, model_arch, classes_length)
+    return model.to(memory_format=torch.channels_last)
+
+# Model cache key of a served model
+def model_key(local_path: str, cloud_path: str, model_arch: str, classes_length: int,
+              optimized: bool = False):
+    return (cloud_path, local_path, model_arch, int(classes_length), bool(optimized))
+
+# Return a ready model from the in-memory cache, loading it on first use.
+# A pinned model is never evicted from the cache. The digest of the weight
+# files it was loaded from is kept in model_digests.
+def get_model(local_path: str, cloud_path: str, model_arch: str, classes_length: int,
+              optimized: bool = False, pin: bool = False):
+    key = model_key(local_path, cloud_path, model_arch, classes_length, optimized)
+    loader = load_optimized_model if optimized else load_model
 
-    # Fetch and preprocess image
+    def load():
+        _load_sources.paths = []
+        try:
+            model = loader(local_path, cloud_path, model_arch, classes_length)
+            model_digests[key] = weight_digest(_load_sources.paths)
+        finally:
+            _load_sources.paths = None
+        return model
+
+    return model_cache.get(key, load, pin=pin)
+
+# Weight digest of a resident model, None when it isn't loaded
+def model_digest(key):
+    return model_digests.get(key) if key in model_cache else None
+
+# Download an image's bytes; the duration is added to `timings` when given
+def fetch_image_bytes(image_url: str, timings: dict = None) -> bytes:
     log("\nLoading and preprocessing image...")
-    resp = session.get(image_url, timeout=10)
-    if resp.status_code != 200:
-        raise ValueError(f"Failed to download image: HTTP {resp.status_code}")
-    img = Image.open(BytesIO(resp.content)).convert("RGB")
-    tensor = preprocess(img).unsqueeze(0)
+    with timed(CLASSIFY_STAGE_SECONDS, "image_download", timings):
+        return image_fetcher.fetch(image_url)
+
+# Decode, resize and crop image bytes into a uint8 (3, 224, 224) tensor;
+# normalization happens per batch in predict_batch
+def image_tensor(data: bytes, timings: dict = None):
+    with timed(CLASSIFY_STAGE_SECONDS, "preprocess", timings):
+        tensor = resize_center_crop(decode_image(data))
     log("Image preprocessed successfully")
+    return tensor
+
+# Cache key of an image's contents, for the result cache
+def content_key(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
 
-    # Inference
-    log("\nRunning inference...")
-    with torch.no_grad():
-        out = model(tensor)
-        probs = torch.nn.functional.softmax(out[0], dim=0).tolist()
+# Download an image and turn it into a uint8 (3, 224, 224) tensor.
+# Stage durations are added to `timings` when given.
+def fetch_image_tensor(image_url: str, timings: dict = None):
+    return image_tensor(fetch_image_bytes(image_url, timings), timings)
+
+# Turn one row of logits into the softmax/threshold result dict
+def make_result(logits, threshold: float = 0.58):
+    probs = torch.nn.functional.softmax(logits, dim=0).tolist()
 
-    # Threshold decision
-    threshold = 0.58
     max_conf = max(probs) if probs else 0.0
     pred_idx = int(np.argmax(probs)) if probs else None
 
@@ -144,7 +257,7 @@ def classify_image(image_url: str, local_path: str, cloud_path: str,
         predicted_label = "other/uncertain"
         is_other = True
 
-    result = {
+    return {
         "predicted_class": pred_idx if not is_other else None,
         "predicted_label": predicted_label,
         "confidences": probs,
@@ -152,30 +265,128 @@ def classify_image(image_url: str, local_path: str, cloud_path: str,
         "max_confidence": max_conf
     }
 
+# Classify a list of preprocessed image tensors in a single forward pass.
+# Optimized models take channels_last input under inference_mode.
+def predict_batch(model, tensors, optimized: bool = False):
+    log(f"\nRunning inference on a batch of {len(tensors)}...")
+    with timed(CLASSIFY_STAGE_SECONDS, "normalize"):
+        batch = normalize_batch(torch.stack(tensors))
+    if optimized:
+        with timed(CLASSIFY_STAGE_SECONDS, "forward"), torch.inference_mode():
+            out = model(batch.contiguous(memory_format=torch.channels_last))
+    else:
+        with timed(CLASSIFY_STAGE_SECONDS, "forward"), torch.no_grad():
+            out = model(batch)
+    return [make_result(row) for row in out]
+
+# Run dummy batches through a freshly loaded model so the first real
+# request finds its kernels selected and allocator pools sized. Not timed
+# into the forward-pass metrics.
+def warm_up(model, batch_sizes=(1,), optimized: bool = False):
+    for size in batch_sizes:
+        batch = normalize_batch(torch.zeros(size, 3, 224, 224, dtype=torch.uint8))
+        if optimized:
+            with torch.inference_mode():
+                model(batch.contiguous(memory_format=torch.channels_last))
+        else:
+            with torch.no_grad():
+                model(batch)
+
+# Classify a preprocessed image tensor with an already loaded model
+def predict(model, tensor):
+    return predict_batch(model, [tensor])[0]
+
+# Main classification function
+def classify_image(image_url: str, local_path: str, cloud_path: str,
+                   model_arch: str, classes_length: int):
+    log("\n=== Starting Classification Process ===")
+    log(f"Image URL: {image_url}")
+    log(f"Model architecture: {model_arch}")
+    log(f"Number of classes: {classes_length}")
+
+    model = get_model(local_path, cloud_path, model_arch, classes_length)
+    tensor = fetch_image_tensor(image_url)
+    result = predict(model, tensor)
+
     log("\nClassification completed successfully")
     log(f"Result: {json.dumps(result, indent=2)}")
-    print(json.dumps(result))
     return result
 
+# Classify many images with one model load. Downloads run concurrently and
+# ready images are run through the model in batches; results are yielded
+# as each batch completes, tagged with the URL's position in the input.
+def classify_batch(image_urls, local_path: str, cloud_path: str,
+                   model_arch: str, classes_length: int,
+                   batch_size: int = 16, download_workers: int = 8):
+    log(f"\n=== Starting Batch Classification of {len(image_urls)} images ===")
+    model = get_model(local_path, cloud_path, model_arch, classes_length)
+
+    def flush(pending):
+        results = predict_batch(model, [tensor for _, _, tensor in pending])
+        for (index, url, _), result in zip(pending, results):
+            yield {"index": index, "image_url": url, **result}
+        pending.clear()
+
+    pending = []
+    with ThreadPoolExecutor(max_workers=download_workers) as pool:
+        futures = {pool.submit(fetch_image_tensor, url): (i, url)
+                   for i, url in enumerate(image_urls)}
+        for future in as_completed(futures):
+            index, url = futures[future]
+            try:
+                pending.append((index, url, future.result()))
+            except Exception as e:
+                log(f"Failed to load {url}: {e}")
+                yield {"index": index, "image_url": url, "error": str(e)}
+                continue
+            if len(pending) >= batch_size:
+                yield from flush(pending)
+    if pending:
+        yield from flush(pending)
+
+# Read one image URL per line from a file, or stdin for "-"
+def read_url_list(path: str):
+    f = sys.stdin if path == "-" else open(path, "r")
+    try:
+        return [line.strip() for line in f if line.strip()]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
 # CLI entrypoint
 if __name__ == '__main__':
-    print("\n=== STARTING CLASSIFICATION SCRIPT ===")
-    if len(sys.argv) != 6:
-        print("Usage: python classify_image.py <image_url> <local_path> <cloud_path> <model_arch> <classes_length>")
+    batch_mode = len(sys.argv) > 1 and sys.argv[1] == "--batch"
+    if batch_mode:
+        # stdout carries NDJSON only in batch mode
+        log("\n=== STARTING BATCH CLASSIFICATION SCRIPT ===")
+        args = sys.argv[2:]
+    else:
+        print("\n=== STARTING CLASSIFICATION SCRIPT ===")
+        args = sys.argv[1:]
+    if len(args) != 5:
+        print("Usage: python classify_image.py <image_url> <local_path> <cloud_path> <model_arch> <classes_length>\n"
+              "       python classify_image.py --batch <url_file|-> <local_path> <cloud_path> <model_arch> <classes_length>")
         sys.exit(1)
 
-    image_url  = sys.argv[1] or ""
-    local_path = sys.argv[2] or ""
-    cloud_path = sys.argv[3] or ""
-    model_arch = sys.argv[4] or ""
+    image_url  = args[0] or ""
+    local_path = args[1] or ""
+    cloud_path = args[2] or ""
+    model_arch = args[3] or ""
     try:
-        classes_length = int(sys.argv[5])
+        classes_length = int(args[4])
     except ValueError:
         log("ERROR: classes_length must be an integer")
         sys.exit(1)
 
     try:
-        classify_image(image_url, local_path, cloud_path, model_arch, classes_length)
+        if batch_mode:
+            image_urls = read_url_list(image_url)
+            for result in classify_batch(image_urls, local_path, cloud_path,
+                                         model_arch, classes_length):
+                print(json.dumps(result), flush=True)
+        else:
+            result = classify_image(image_url, local_path, cloud_path, model_arch, classes_length)
+            print(json.dumps(result))
     except Exception as e:
         log(f"Classification failed: {e}")
         sys.exit(1)
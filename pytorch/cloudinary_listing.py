@@ -0,0 +1,184 @@
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LISTING_VERSION = 1
+# resource fields kept in the manifest
+FIELDS = ('public_id', 'secure_url', 'bytes', 'etag', 'width', 'height', 'format', 'created_at')
+# characters with a meaning in search expressions
+SEARCH_RESERVED = re.compile(r'([!(){}\[\]*^~?:\\=&><"\s])')
+
+
+# Thin adapter over the Cloudinary SDK. Anything with the same two methods
+# (and optionally rate_limit_errors) can stand in for it, e.g.
+# benchmarks.fakes.FakeCloudinaryApi.
+class CloudinaryApi:
+    def __init__(self):
+        import cloudinary.api
+        from cloudinary.exceptions import RateLimited
+        self._api = cloudinary.api
+        self.rate_limit_errors = (RateLimited,)
+
+    # Admin API listing of every resource under a public_id prefix, newest
+    # created first unless direction says otherwise
+    def resources(self, **params):
+        return self._api.resources(**params)
+
+    # Search API, newest public_id first (uploads are named <ms timestamp>_<file>)
+    def search(self, expression: str, max_results: int = 500, next_cursor: str = None):
+        import cloudinary
+        search = cloudinary.Search().expression(expression).sort_by('public_id', 'desc') \
+            .max_results(max_results)
+        if next_cursor:
+            search = search.next_cursor(next_cursor)
+        return search.execute()
+
+
+def _entry(resource):
+    return {field: resource.get(field) for field in FIELDS}
+
+
+# Persisted, versioned listing of a model's dataset:
+# {"version", "revision", "model", "listed_at", "classes": {class: {"full_listed_at", "resources": [...]}}}
+# `revision` goes up whenever the listed images change.
+class ListingManifest:
+    def __init__(self, path: str, model_name: str):
+        self.path = path
+        self.data = {'version': LISTING_VERSION, 'revision': 0, 'model': model_name,
+                     'listed_at': None, 'classes': {}}
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == LISTING_VERSION:
+                self.data = data
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def resources(self, cls: str):
+        entry = self.data['classes'].get(cls)
+        return entry['resources'] if entry else None
+
+    def full_listed_at(self, cls: str) -> float:
+        entry = self.data['classes'].get(cls)
+        return entry['full_listed_at'] if entry else 0.0
+
+    def update(self, cls: str, resources, full: bool) -> bool:
+        resources = sorted(resources, key=lambda r: r['public_id'])
+        old = self.data['classes'].get(cls)
+        changed = old is None or old['resources'] != resources
+        self.data['classes'][cls] = {
+            'full_listed_at': time.time() if full else old['full_listed_at'],
+            'resources': resources,
+        }
+        return changed
+
+    def save(self, changed: bool):
+        if changed:
+            self.data['revision'] += 1
+        self.data['listed_at'] = time.time()
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+    def image_urls(self, class_names):
+        return {cls: [r['secure_url'] for r in self.resources(cls) or []] for cls in class_names}
+
+
+# Call the API, backing off exponentially while it reports rate limiting
+def _call(api, method: str, retries: int = 5, backoff: float = 1.0, **params):
+    errors = getattr(api, 'rate_limit_errors', ())
+    for attempt in range(retries + 1):
+        try:
+            return getattr(api, method)(**params)
+        except errors:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            print(f"  Cloudinary rate limit hit, retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+
+# Every resource under `prefix`, page by page
+def list_full(api, prefix: str, page_size: int = 500):
+    resources, next_cursor = [], None
+    while True:
+        # trailing slash so class "cat" doesn't also list "cats"
+        params = {'type': 'upload', 'prefix': f'{prefix}/', 'max_results': page_size}
+        if next_cursor:
+            params['next_cursor'] = next_cursor
+        res = _call(api, 'resources', **params)
+        resources.extend(_entry(r) for r in res.get('resources', []))
+        next_cursor = res.get('next_cursor')
+        if not next_cursor:
+            return resources
+
+
+# Search expression matching every public_id that starts with `prefix`
+def prefix_expression(prefix: str) -> str:
+    return 'public_id:' + SEARCH_RESERVED.sub(r'\\\1', prefix) + '*'
+
+
+# Pages of `method` results, newest first, until one contains a known
+# public_id; returns the unknown resources seen on the way
+def _unknown_newest(api, method: str, known_ids, **params):
+    new, next_cursor = [], None
+    while True:
+        if next_cursor:
+            params['next_cursor'] = next_cursor
+        res = _call(api, method, **params)
+        page = res.get('resources', [])
+        new.extend(_entry(r) for r in page if r['public_id'] not in known_ids)
+        next_cursor = res.get('next_cursor')
+        if not next_cursor or any(r['public_id'] in known_ids for r in page):
+            return new
+
+
+# Resources under `prefix` that aren't in `known` yet. Searches newest
+# first and stops at the first page containing a known public_id, so a
+# refresh with few new uploads costs a single small request. The search
+# index lags behind uploads, so "nothing new" is only trusted once the
+# Admin API's newest-created page agrees.
+def list_delta(api, prefix: str, known, page_size: int = 100):
+    known_ids = {r['public_id'] for r in known}
+    new = _unknown_newest(api, 'search', known_ids, expression=prefix_expression(f'{prefix}/'),
+                          max_results=page_size)
+    if not new:
+        new = _unknown_newest(api, 'resources', known_ids, type='upload', prefix=f'{prefix}/',
+                              direction='desc', max_results=page_size)
+    return new
+
+
+# List the images of every class of a model concurrently (at most `workers`
+# requests in flight) and persist them in a per-model manifest under
+# `manifest_dir`. Classes listed in full within the last `max_age` seconds
+# are only refreshed with a delta of new uploads; deletions are picked up by
+# the next full listing. Returns ({class: [urls]}, manifest).
+def list_dataset(model_name: str, class_names, manifest_dir: str, api=None,
+                 workers: int = 4, max_age: float = 24 * 3600, force_full: bool = False):
+    api = api or CloudinaryApi()
+    manifest = ListingManifest(os.path.join(manifest_dir, f'{model_name}.json'), model_name)
+
+    def refresh(cls):
+        prefix = f'dataset/{model_name}/{cls}'
+        known = manifest.resources(cls)
+        if known is not None and not force_full and time.time() - manifest.full_listed_at(cls) < max_age:
+            new = list_delta(api, prefix, known)
+            print(f"  {cls}: {len(new)} new images since last listing")
+            return cls, known + new, False
+        resources = list_full(api, prefix)
+        print(f"  {cls}: listed {len(resources)} images")
+        return cls, resources, True
+
+    print(f"\n=== LISTING {len(class_names)} CLASSES ===")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        results = list(pool.map(refresh, class_names))
+    changed = False
+    for cls, resources, full in results:
+        changed = manifest.update(cls, resources, full) or changed
+    manifest.save(changed)
+    print(f"Listing manifest revision {manifest.data['revision']} saved to {manifest.path}")
+    return manifest.image_urls(class_names), manifest
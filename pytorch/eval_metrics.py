@@ -0,0 +1,73 @@
+import torch
+
+from preprocessing import normalize_batch
+
+
+# Classification metrics accumulated on the device the model runs on.
+# Each batch adds a bincount of (label, prediction) pairs to a confusion
+# matrix and its summed loss to a scalar tensor; nothing is copied to the
+# host until compute(), so a whole epoch costs one sync.
+class ConfusionMatrix:
+    def __init__(self, num_classes: int, device=None):
+        self.num_classes = num_classes
+        self.matrix = torch.zeros(num_classes, num_classes, dtype=torch.long, device=device)
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+
+    # `loss` is the batch's mean loss, as returned by the criterion
+    def update(self, preds, labels, loss=None):
+        n = self.num_classes
+        idx = labels.view(-1) * n + preds.view(-1)
+        self.matrix += torch.bincount(idx, minlength=n * n).view(n, n)
+        if loss is not None:
+            self.loss_sum += loss.detach().double() * labels.numel()
+
+    # Loss and accuracy so far (one small sync), for progress reporting
+    def running(self) -> dict:
+        count = int(self.matrix.sum())
+        correct = int(self.matrix.diag().sum())
+        return {'count': count,
+                'loss': self.loss_sum.item() / count if count else 0.0,
+                'accuracy': correct / count if count else 0.0}
+
+    def compute(self, class_names=None) -> dict:
+        matrix = self.matrix.cpu()
+        loss_sum = self.loss_sum.item()
+        count = int(matrix.sum())
+        tp = matrix.diag().double()
+        support = matrix.sum(1).double()
+        predicted = matrix.sum(0).double()
+        precision = torch.where(predicted > 0, tp / predicted.clamp(min=1), torch.zeros_like(tp))
+        recall = torch.where(support > 0, tp / support.clamp(min=1), torch.zeros_like(tp))
+        f1 = torch.where(precision + recall > 0,
+                         2 * precision * recall / (precision + recall).clamp(min=1e-12),
+                         torch.zeros_like(tp))
+        names = list(class_names) if class_names is not None else [str(i) for i in range(self.num_classes)]
+        present = support > 0
+        return {
+            'count': count,
+            'loss': loss_sum / count if count else 0.0,
+            'accuracy': float(tp.sum() / count) if count else 0.0,
+            'macro_f1': float(f1[present].mean()) if present.any() else 0.0,
+            'per_class': {
+                name: {'precision': float(precision[i]), 'recall': float(recall[i]),
+                       'f1': float(f1[i]), 'support': int(support[i])}
+                for i, name in enumerate(names)
+            },
+            'confusion_matrix': matrix.tolist(),
+        }
+
+
+# Score a model over a DataLoader of (inputs, labels) batches
+def evaluate(model, loader, num_classes: int, device, criterion=None, class_names=None) -> dict:
+    metrics = ConfusionMatrix(num_classes, device)
+    model.eval()
+    with torch.inference_mode():
+        for inputs, labels in loader:
+            if inputs is None:
+                continue
+            inputs = normalize_batch(inputs.to(device, non_blocking=True))
+            labels = labels.to(device, non_blocking=True)
+            outputs = model(inputs)
+            loss = criterion(outputs, labels) if criterion is not None else None
+            metrics.update(outputs.argmax(1), labels, loss)
+    return metrics.compute(class_names)
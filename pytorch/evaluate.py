@@ -0,0 +1,77 @@
+import argparse
+import ast
+import json
+import os
+import sys
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from classify_image import load_model
+from eval_metrics import evaluate
+from image_cache import ImageCache, prefetch_images
+from incremental import diff_listing, load_manifest
+from model_artifacts import MANIFEST_SUFFIX, sibling_path
+from robust_data import Quarantine, skip_none_collate
+from train_model import (DATASET_CACHE_DIR, PREFETCH_WORKERS, CloudinaryDataset,
+                         get_image_urls_from_cloudinary, get_transforms)
+
+
+def print_report(report):
+    print(f"\nSamples: {report['count']}  Loss: {report['loss']:.4f}  "
+          f"Accuracy: {report['accuracy']:.4f}  Macro F1: {report['macro_f1']:.4f}")
+    width = max((len(name) for name in report['per_class']), default=5)
+    print(f"{'class':<{width}}  precision  recall     f1  support")
+    for name, m in report['per_class'].items():
+        print(f"{name:<{width}}  {m['precision']:9.4f}  {m['recall']:6.4f}  {m['f1']:.4f}  {m['support']:7d}")
+    print('\nConfusion matrix (rows = true class, columns = predicted):')
+    for name, row in zip(report['per_class'], report['confusion_matrix']):
+        print(f"{name:<{width}}  " + ' '.join(f'{v:5d}' for v in row))
+
+
+# Score a saved model against its labeled Cloudinary dataset
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        usage='python evaluate.py <model_name> <classes> <arch> <local_path> [options]')
+    parser.add_argument('model_name')
+    parser.add_argument('classes')
+    parser.add_argument('arch')
+    parser.add_argument('local_path')
+    parser.add_argument('--cloud-path', default='', help='gs:// path of the model, tried before local_path')
+    parser.add_argument('--unseen', action='store_true',
+                        help="only images missing from the model's training manifest")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--output', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    classes = ast.literal_eval(args.classes)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    image_urls = get_image_urls_from_cloudinary(args.model_name, classes)
+    if args.unseen:
+        manifest = load_manifest(sibling_path(args.local_path, MANIFEST_SUFFIX))
+        if manifest is None:
+            print('No training manifest next to the model, evaluating every image')
+        else:
+            image_urls, _ = diff_listing(manifest, image_urls)
+
+    quarantine = Quarantine(os.path.join(DATASET_CACHE_DIR, 'quarantine.ndjson'))
+    local_paths = prefetch_images(image_urls, ImageCache(DATASET_CACHE_DIR), workers=PREFETCH_WORKERS,
+                                  quarantine=quarantine)
+    _, val_tf = get_transforms()
+    dataset = CloudinaryDataset(image_urls, val_tf, is_training=False, local_paths=local_paths,
+                                quarantine=quarantine)
+    if len(dataset) == 0:
+        print('Nothing to evaluate')
+        sys.exit(0)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False,
+                        num_workers=min(4, os.cpu_count() or 1), collate_fn=skip_none_collate)
+
+    model = load_model(args.local_path, args.cloud_path, args.arch, len(classes)).to(device)
+    report = evaluate(model, loader, len(classes), device, criterion=nn.CrossEntropyLoss(),
+                      class_names=classes)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Report written to {args.output}')
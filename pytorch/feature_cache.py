@@ -0,0 +1,85 @@
+import os
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset
+from torch.utils.data.dataloader import default_collate
+
+from preprocessing import normalize_batch
+
+
+# The trainable part of a transfer-learning model: the new Linear head plus
+# the dropout that precedes it in the full forward pass. The Linear is the
+# model's own module, so training this also trains the model.
+def head_module(model):
+    if hasattr(model, 'fc'):
+        dropout = getattr(model, 'dropout', None)
+        p = dropout.p if isinstance(dropout, nn.Dropout) else 0.0
+        return nn.Sequential(nn.Dropout(p), model.fc)
+    return model.classifier  # mobilenet_v2: Dropout + Linear
+
+
+# Dataset wrapper that also yields each sample's index, so failed samples
+# can be dropped from a batch without losing track of the others
+class _Indexed(Dataset):
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        img, label = self.dataset[idx]
+        return idx, img, label
+
+
+def _indexed_collate(batch):
+    batch = [sample for sample in batch if sample[1] is not None]
+    return default_collate(batch) if batch else None
+
+
+# Run the frozen backbone (model minus its head) over every sample of
+# `dataset` in order and return (features, labels) on the CPU, one row per
+# sample; samples that fail to load get zero features and label -1. Results
+# are saved to cache_path and loaded from there on later calls.
+def extract_features(model, dataset, cache_path: str, device, batch_size: int = 64,
+                     num_workers: int = 0):
+    if os.path.exists(cache_path):
+        cached = torch.load(cache_path, map_location='cpu')
+        print(f"Loaded cached features {cache_path} {tuple(cached['features'].shape)}")
+        return cached['features'], cached['labels']
+
+    attr = 'fc' if hasattr(model, 'fc') else 'classifier'
+    head = getattr(model, attr)
+    setattr(model, attr, nn.Identity())
+    was_training = model.training
+    model.eval()
+    features = None
+    labels = torch.full((len(dataset),), -1, dtype=torch.long)
+    try:
+        loader = DataLoader(_Indexed(dataset), batch_size=batch_size, shuffle=False,
+                            num_workers=num_workers, pin_memory=device.type == 'cuda',
+                            collate_fn=_indexed_collate)
+        with torch.no_grad():
+            for batch in loader:
+                if batch is None:
+                    continue
+                idx, inputs, lbls = batch
+                inputs = normalize_batch(inputs.to(device, non_blocking=True))
+                out = model(inputs).float().cpu()
+                if features is None:
+                    features = torch.zeros(len(dataset), out.shape[1])
+                features[idx] = out
+                labels[idx] = lbls
+    finally:
+        setattr(model, attr, head)
+        model.train(was_training)
+    if features is None:
+        raise RuntimeError("No sample could be loaded for feature extraction")
+
+    print(f"Extracted features for {len(dataset)} samples: {tuple(features.shape)}")
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    torch.save({'features': features, 'labels': labels}, tmp_path)
+    os.replace(tmp_path, cache_path)
+    return features, labels
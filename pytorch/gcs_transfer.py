@@ -0,0 +1,122 @@
+import base64
+import hashlib
+import math
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import google_crc32c
+except ImportError:  # optional, md5 is used when it's missing
+    google_crc32c = None
+
+# GCS compose takes at most 32 source objects
+MAX_COMPOSE_PARTS = 32
+
+
+class ChecksumError(IOError):
+    pass
+
+
+# base64 crc32c and md5 of a file, in the format GCS reports them
+def file_checksums(path: str, block_size: int = 8 * 1024 * 1024) -> dict:
+    md5 = hashlib.md5()
+    crc = google_crc32c.Checksum() if google_crc32c else None
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+            if crc is not None:
+                crc.update(block)
+    return {
+        'md5': base64.b64encode(md5.digest()).decode('ascii'),
+        'crc32c': base64.b64encode(crc.digest()).decode('ascii') if crc is not None else None,
+    }
+
+
+# Check a local file against the blob's metadata: crc32c when available
+# (composite objects have no md5), else md5, else just the size
+def verify(blob, path: str):
+    if blob.size is not None and os.path.getsize(path) != blob.size:
+        raise ChecksumError(f"Size mismatch for {blob.name}: {os.path.getsize(path)} != {blob.size}")
+    sums = file_checksums(path)
+    if blob.crc32c and sums['crc32c']:
+        if sums['crc32c'] != blob.crc32c:
+            raise ChecksumError(f"crc32c mismatch for {blob.name}")
+    elif blob.md5_hash and sums['md5'] != blob.md5_hash:
+        raise ChecksumError(f"md5 mismatch for {blob.name}")
+
+
+def _slices(size: int, slice_size: int, max_slices: int = None):
+    if max_slices:
+        slice_size = max(slice_size, math.ceil(size / max_slices))
+    return [(start, min(slice_size, size - start)) for start in range(0, size, slice_size)]
+
+
+# Download a blob (with metadata loaded, e.g. from bucket.get_blob) to
+# `path`. Blobs of at least `threshold` bytes are fetched as byte-range
+# slices by `workers` threads writing into a preallocated file. The result
+# is verified against the blob's checksum; a mismatch removes the file.
+def download(blob, path: str, workers: int = 8, slice_size: int = 32 * 1024 * 1024,
+             threshold: int = 64 * 1024 * 1024):
+    size = blob.size or 0
+    try:
+        if workers <= 1 or size < threshold:
+            blob.download_to_filename(path)
+        else:
+            with open(path, 'wb') as f:
+                f.truncate(size)
+
+            def fetch(piece):
+                start, length = piece
+                # ranged reads can't be checksummed per slice; the whole file is verified below
+                data = blob.download_as_bytes(start=start, end=start + length - 1, checksum=None)
+                with open(path, 'r+b') as f:
+                    f.seek(start)
+                    f.write(data)
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(fetch, _slices(size, slice_size)))
+        verify(blob, path)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+# Upload `path` to bucket/blob_name. Files of at least `threshold` bytes
+# are uploaded as up to 32 parts by `workers` threads and composed into the
+# final object server-side; the parts are deleted afterwards. The uploaded
+# object is verified against the local file's checksum.
+def upload(bucket, blob_name: str, path: str, workers: int = 8,
+           slice_size: int = 32 * 1024 * 1024, threshold: int = 64 * 1024 * 1024,
+           chunk_size: int = 5 * 1024 * 1024, timeout: float = 300):
+    size = os.path.getsize(path)
+    blob = bucket.blob(blob_name)
+    if workers <= 1 or size < threshold:
+        # resumable upload in chunk_size pieces, each with its own timeout
+        blob.chunk_size = chunk_size
+        blob.upload_from_filename(path, timeout=timeout)
+    else:
+        prefix = f"{blob_name}.part-{uuid.uuid4().hex[:8]}"
+        pieces = _slices(size, slice_size, MAX_COMPOSE_PARTS)
+        parts = [bucket.blob(f"{prefix}-{i:02d}") for i in range(len(pieces))]
+
+        def send(args):
+            part, (start, length) = args
+            with open(path, 'rb') as f:
+                f.seek(start)
+                part.upload_from_string(f.read(length), timeout=timeout)
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(send, zip(parts, pieces)))
+            blob.compose(parts, timeout=timeout)
+        finally:
+            for part in parts:
+                try:
+                    part.delete()
+                except Exception:
+                    pass
+    blob.reload()
+    verify(blob, path)
+    return blob
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from image_fetcher import ImageFetcher, UnusableImage
+
+
+# Content-addressed local store of dataset images.
+#
+# Image bytes are stored under their sha256 digest, and urls.json maps each
+# source URL to its digest. Cloudinary delivery URLs are versioned, so a URL
+# that is already in the index never needs to be downloaded again, whether
+# by a later epoch or a later training run.
+class ImageCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self._index_path = os.path.join(cache_dir, "urls.json")
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        try:
+            with open(self._index_path, "r") as f:
+                self._index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._index = {}
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    # Local file for a URL, or None if it hasn't been fetched yet
+    def path_for(self, url: str):
+        with self._lock:
+            digest = self._index.get(url)
+        if digest is None:
+            return None
+        path = self._object_path(digest)
+        return path if os.path.exists(path) else None
+
+    def put(self, url: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with self._lock:
+            self._index[url] = digest
+        return path
+
+    def save(self):
+        with self._lock:
+            tmp_path = self._index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._index, f)
+            os.replace(tmp_path, self._index_path)
+
+
+# Download every image in {class: [urls]} that isn't cached yet, with at
+# most `workers` downloads in flight: the fetcher's deadline starts at
+# submit, so queueing everything up front would time out the tail. URLs in
+# `quarantine` are skipped, and URLs that come back unusable are added to it. Returns
+# {url: local path} for every image that is available locally afterwards.
+def prefetch_images(image_urls, cache: ImageCache, workers: int = 16, timeout: float = 30,
+                    quarantine=None):
+    all_urls = [url for urls in image_urls.values() for url in urls]
+    local_paths = {}
+    missing = []
+    for url in all_urls:
+        if quarantine is not None and url in quarantine:
+            continue
+        path = cache.path_for(url)
+        if path:
+            local_paths[url] = path
+        else:
+            missing.append(url)
+    print(f"\n=== Prefetching images: {len(local_paths)} cached, {len(missing)} to download ===")
+
+    if missing:
+        # images are written straight to the cache, so no bytes cache here
+        fetcher = ImageFetcher(per_host=workers, timeout=timeout, deadline=4 * timeout,
+                               retries=3, cache_ttl=0)
+        failed = 0
+        pending = iter(missing)
+        futures = {}
+        try:
+            while True:
+                while len(futures) < workers:
+                    url = next(pending, None)
+                    if url is None:
+                        break
+                    futures[fetcher.submit(url)] = url
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = futures.pop(future)
+                    try:
+                        local_paths[url] = cache.put(url, future.result())
+                    except Exception as e:
+                        failed += 1
+                        print(f"[ERROR] prefetch {url}: {e}")
+                        # 4xx, not an image or too large; timeouts, 429 and 5xx may be transient
+                        if quarantine is not None and isinstance(e, UnusableImage):
+                            quarantine.add(url, str(e))
+        finally:
+            fetcher.close()
+        cache.save()
+        print(f"Downloaded {len(missing) - failed} images, {failed} failed")
+    return local_paths
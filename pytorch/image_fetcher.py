@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import aiohttp
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+# The image itself is unusable (4xx, not an image, too large); retrying or
+# fetching it again later won't help
+class UnusableImage(ValueError):
+    pass
+
+
+# 429 / 5xx: retried, and still a transient failure once retries run out
+class _RetryableStatus(IOError):
+    pass
+
+
+# Image downloader shared by classification and training.
+#
+# Downloads run on an asyncio loop in a background thread; threaded callers
+# use fetch() / submit(). Connections are pooled with at most `per_host`
+# open to any one host. Concurrent requests for a URL already being
+# downloaded wait on that download instead of starting their own. Bodies
+# are streamed and abandoned as soon as they go over max_bytes, and each
+# download (retries included) must finish within `deadline` seconds.
+# Recently fetched images are kept in a small TTL cache bounded in bytes.
+class ImageFetcher:
+    def __init__(self, per_host: int = 8, max_bytes: int = 20 * 1024 * 1024,
+                 timeout: float = 10.0, deadline: float = 30.0, retries: int = 2,
+                 backoff: float = 0.5, cache_ttl: float = 60.0,
+                 cache_max_bytes: int = 64 * 1024 * 1024):
+        self.per_host = max(1, int(per_host))
+        self.max_bytes = int(max_bytes)
+        self.timeout = float(timeout)
+        self.deadline = float(deadline)
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.cache_ttl = float(cache_ttl)
+        self.cache_max_bytes = int(cache_max_bytes)
+        self._start_lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._session = None
+        # only touched from the loop thread
+        self._inflight = {}            # url -> Task shared by waiters
+        self._cache = OrderedDict()    # url -> (expires_at, data)
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.too_large = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="image-fetcher", daemon=True)
+                thread.start()
+                self._loop, self._thread = loop, thread
+            return self._loop
+
+    # Start fetching `url`; the returned Future resolves to the image bytes
+    def submit(self, url: str, deadline: float = None) -> Future:
+        return asyncio.run_coroutine_threadsafe(self._get(url, deadline), self._ensure_loop())
+
+    def fetch(self, url: str, deadline: float = None) -> bytes:
+        return self.submit(url, deadline).result()
+
+    def close(self):
+        with self._start_lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close_session(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.per_host, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _get(self, url: str, deadline: float = None) -> bytes:
+        data = self._cache_get(url)
+        if data is not None:
+            self.hits += 1
+            return data
+        task = self._inflight.get(url)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(
+                self._download(url, self.deadline if deadline is None else deadline))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        else:
+            self.coalesced += 1
+        # one waiter giving up must not cancel the download for the others
+        return await asyncio.shield(task)
+
+    async def _download(self, url: str, deadline: float) -> bytes:
+        try:
+            data = await asyncio.wait_for(
+                self._download_with_retries(url, time.monotonic() + deadline), deadline)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise TimeoutError(f"Timed out downloading {url} (deadline {deadline:.1f}s)")
+        except Exception:
+            self.errors += 1
+            raise
+        self._cache_put(url, data)
+        return data
+
+    async def _download_with_retries(self, url: str, deadline_at: float) -> bytes:
+        session = self._get_session()
+        attempt = 0
+        while True:
+            timeout = min(self.timeout, max(deadline_at - time.monotonic(), 0.001))
+            try:
+                return await self._download_once(session, url, timeout)
+            except (aiohttp.ClientError, asyncio.TimeoutError, _RetryableStatus):
+                if attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    async def _download_once(self, session, url: str, timeout: float) -> bytes:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+            if resp.status in RETRY_STATUSES:
+                raise _RetryableStatus(f"Invalid response for URL: {url} (HTTP {resp.status})")
+            if resp.status != 200 or 'image' not in resp.headers.get('Content-Type', ''):
+                raise UnusableImage(f"Invalid response for URL: {url} (HTTP {resp.status})")
+            if resp.content_length is not None and resp.content_length > self.max_bytes:
+                self.too_large += 1
+                raise UnusableImage(f"Image too large: {url} ({resp.content_length} bytes)")
+            body = bytearray()
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                body.extend(chunk)
+                if len(body) > self.max_bytes:
+                    self.too_large += 1
+                    raise UnusableImage(f"Image too large: {url} (over {self.max_bytes} bytes)")
+            return bytes(body)
+
+    def _cache_get(self, url: str):
+        entry = self._cache.get(url)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at < time.monotonic():
+            del self._cache[url]
+            self._cached_bytes -= len(data)
+            return None
+        self._cache.move_to_end(url)
+        return data
+
+    def _cache_put(self, url: str, data: bytes):
+        if self.cache_ttl <= 0 or len(data) > self.cache_max_bytes:
+            return
+        old = self._cache.pop(url, None)
+        if old is not None:
+            self._cached_bytes -= len(old[1])
+        self._cache[url] = (time.monotonic() + self.cache_ttl, data)
+        self._cached_bytes += len(data)
+        while self._cached_bytes > self.cache_max_bytes:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._inflight),
+            'cached': len(self._cache),
+            'cached_bytes': self._cached_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'too_large': self.too_large,
+            'timeouts': self.timeouts,
+            'errors': self.errors,
+        }
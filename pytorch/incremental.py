@@ -0,0 +1,91 @@
+import json
+import os
+import random
+import time
+
+import torch
+import torch.nn as nn
+
+MANIFEST_VERSION = 1
+
+
+# The images a saved model was trained on, stored next to its .pth:
+# {"version", "arch", "classes": [...], "images": {class: [urls]}, "updated_at"}
+def load_manifest(path: str):
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        print(f"Ignoring manifest {path} with unsupported version {manifest.get('version')}")
+        return None
+    return manifest
+
+
+def save_manifest(path: str, arch: str, image_urls) -> str:
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'arch': arch,
+        'classes': list(image_urls),
+        'images': {cls: list(urls) for cls, urls in image_urls.items()},
+        'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Split the current listing into images the model has not seen yet and
+# images it was already trained on, both as {class: [urls]} in listing order
+def diff_listing(manifest, image_urls):
+    trained = {cls: set(urls) for cls, urls in (manifest or {}).get('images', {}).items()}
+    new, old = {}, {}
+    for cls, urls in image_urls.items():
+        seen = trained.get(cls, set())
+        new[cls] = [url for url in urls if url not in seen]
+        old[cls] = [url for url in urls if url in seen]
+    return new, old
+
+
+# Random replay sample of already-trained images, so fine-tuning on new
+# data doesn't make the head forget the old data: `ratio` of each class,
+# but at least `min_per_class` images where that many exist
+def replay_sample(old_urls, ratio: float = 0.2, min_per_class: int = 10, seed: int = None):
+    rng = random.Random(seed)
+    sample = {}
+    for cls, urls in old_urls.items():
+        k = min(len(urls), max(min_per_class, int(round(ratio * len(urls)))))
+        sample[cls] = rng.sample(urls, k)
+    return sample
+
+
+# Training set for an incremental run: new images plus the replay sample,
+# keyed in `classes` order so label indices follow the requested classes
+def incremental_urls(classes, new_urls, replay_urls):
+    return {cls: new_urls.get(cls, []) + replay_urls.get(cls, []) for cls in classes}
+
+
+# Swap the model's final Linear for one sized for `new_classes`, copying the
+# trained rows of classes that already existed (matched by name) so only
+# genuinely new classes start from scratch
+def expand_head(model, old_classes, new_classes):
+    if hasattr(model, 'fc'):
+        old_fc = model.fc
+    else:
+        old_fc = model.classifier[1]
+    new_fc = nn.Linear(old_fc.in_features, len(new_classes)).to(old_fc.weight.device)
+    old_index = {cls: i for i, cls in enumerate(old_classes)}
+    with torch.no_grad():
+        for i, cls in enumerate(new_classes):
+            j = old_index.get(cls)
+            if j is not None:
+                new_fc.weight[i].copy_(old_fc.weight[j])
+                new_fc.bias[i].copy_(old_fc.bias[j])
+    if hasattr(model, 'fc'):
+        model.fc = new_fc
+    else:
+        model.classifier[1] = new_fc
+    return model
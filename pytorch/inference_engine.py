@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+
+from batcher import MicroBatcher
+from classify_image import (content_key, fetch_image_bytes, get_model, image_tensor, log,
+                            model_cache, model_digest, model_key, predict_batch, result_cache,
+                            warm_up, weight_cache)
+from model_artifacts import INT8_SUFFIX, SCRIPT_SUFFIX, sibling_path
+from metrics import CLASSIFY_IMAGES, CLASSIFY_STAGE_SECONDS, timed
+
+
+# Copy the outcome of one future onto another
+def _chain(source: Future, target: Future):
+    if source.exception() is not None:
+        CLASSIFY_IMAGES.inc(status="error")
+        target.set_exception(source.exception())
+    else:
+        CLASSIFY_IMAGES.inc(status="ok")
+        target.set_result(source.result())
+
+
+# JSON-friendly view of a model cache entry
+def _describe(entry) -> dict:
+    cloud_path, local_path, model_arch, classes_length, optimized = entry['key']
+    return {'local_path': local_path, 'cloud_path': cloud_path, 'model_arch': model_arch,
+            'classes_length': classes_length, 'optimized': optimized, 'bytes': entry['bytes'],
+            'pinned': entry['pinned'], 'loaded_at': entry['loaded_at'],
+            'last_used': entry['last_used']}
+
+
+# Long-lived classification engine living inside the server process.
+# torch, torchvision and the GCS client are imported once when the server
+# starts. Image download and preprocessing run on a fixed pool of worker
+# threads, then concurrent requests for the same model are coalesced by a
+# MicroBatcher into one forward pass. With optimized=True models are
+# served as int8 (when quantized at training time) or channels_last fp32.
+# Results are kept in the result cache, keyed by the model's weight digest
+# and by the image URL and content hash, and served from it on a repeat.
+class InferenceEngine:
+    def __init__(self, workers: int = 2, threads: int = None,
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 optimized: bool = False):
+        self.workers = max(1, int(workers))
+        self.optimized = bool(optimized)
+        # Workers only download and preprocess; forward passes run on the
+        # batcher threads with torch's intra-op pool (all cores by default)
+        if threads:
+            torch.set_num_threads(int(threads))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix="classify")
+        self.batcher = MicroBatcher(self._run_batch, max_batch_size=max_batch_size,
+                                    max_wait_ms=max_wait_ms)
+        log(f"Inference engine started: {self.workers} workers, "
+            f"{torch.get_num_threads()} torch threads, "
+            f"batches of up to {self.batcher.max_batch_size}"
+            f"{', optimized' if self.optimized else ''}")
+
+    # Batcher callback: key is the model identity used by the model cache,
+    # items are (tensor, timings, enqueued_at, image_keys) tuples
+    @staticmethod
+    def _run_batch(key, items):
+        cloud_path, local_path, model_arch, classes_length, optimized = key
+        start = time.perf_counter()
+        with timed(CLASSIFY_STAGE_SECONDS, "model_get"):
+            model = get_model(local_path, cloud_path, model_arch, classes_length, optimized)
+        digest = model_digest(key)
+        loaded = time.perf_counter()
+        results = predict_batch(model, [tensor for tensor, _, _, _ in items], optimized)
+        done = time.perf_counter()
+        for (_, timings, enqueued_at, image_keys), result in zip(items, results):
+            result_cache.put(key, digest, image_keys, result)
+            if timings is not None:
+                timings["queue_wait"] = start - enqueued_at
+                timings["model_get"] = loaded - start
+                timings["forward"] = done - loaded
+        return results
+
+    # Queue one image for classification. If a timings dict is passed, it
+    # is filled with the per-stage durations of this request.
+    def submit(self, image_url: str, local_path: str, cloud_path: str,
+               model_arch: str, classes_length: int, timings: dict = None) -> Future:
+        key = model_key(local_path, cloud_path, model_arch, classes_length, self.optimized)
+        result = Future()
+        url_key = "url:" + image_url
+        cached = result_cache.get(key, model_digest(key), url_key, count_miss=False)
+        if cached is not None:
+            CLASSIFY_IMAGES.inc(status="ok")
+            result.set_result(cached)
+            return result
+
+        def prepare():
+            try:
+                data = fetch_image_bytes(image_url, timings)
+                image_key = content_key(data)
+                # same image under another URL
+                digest = model_digest(key)
+                cached = result_cache.get(key, digest, image_key, kind="content")
+                if cached is not None:
+                    result_cache.put(key, digest, [url_key], cached)
+                    CLASSIFY_IMAGES.inc(status="ok")
+                    result.set_result(cached)
+                    return
+                tensor = image_tensor(data, timings)
+            except BaseException as e:
+                CLASSIFY_IMAGES.inc(status="error")
+                result.set_exception(e)
+                return
+            item = (tensor, timings, time.perf_counter(), (url_key, image_key))
+            self.batcher.submit(key, item).add_done_callback(lambda f: _chain(f, result))
+
+        self.executor.submit(prepare)
+        return result
+
+    def classify(self, image_url: str, local_path: str, cloud_path: str,
+                 model_arch: str, classes_length: int, timings: dict = None):
+        return self.submit(image_url, local_path, cloud_path,
+                           model_arch, classes_length, timings).result()
+
+    # Make a model resident (loading it if needed), set whether it is
+    # pinned, and warm it up at batch size 1 and the largest batch the
+    # batcher forms
+    def load(self, local_path: str, cloud_path: str, model_arch: str, classes_length: int,
+             pin: bool = False, warmup: bool = True) -> dict:
+        start = time.perf_counter()
+        model = get_model(local_path, cloud_path, model_arch, classes_length, self.optimized, pin=pin)
+        if not pin:
+            model_cache.unpin(model_key(local_path, cloud_path, model_arch, classes_length,
+                                        self.optimized))
+        loaded = time.perf_counter()
+        if warmup:
+            warm_up(model, sorted({1, self.batcher.max_batch_size}), self.optimized)
+        info = self.resident_model(local_path, cloud_path, model_arch, classes_length) or {}
+        info.update(load_seconds=loaded - start,
+                    warmup_seconds=time.perf_counter() - loaded if warmup else 0.0)
+        return info
+
+    # Drop a model from memory, pinned or not; False if it wasn't loaded
+    def unload(self, local_path: str, cloud_path: str, model_arch: str, classes_length: int) -> bool:
+        return model_cache.discard(model_key(local_path, cloud_path, model_arch, classes_length,
+                                             self.optimized))
+
+    # Resident models with their memory footprint, least recently used first
+    def resident_models(self) -> list:
+        return [_describe(entry) for entry in model_cache.entries()]
+
+    def resident_model(self, local_path: str, cloud_path: str, model_arch: str, classes_length: int):
+        key = model_key(local_path, cloud_path, model_arch, classes_length, self.optimized)
+        for entry in model_cache.entries():
+            if entry['key'] == key:
+                return _describe(entry)
+        return None
+
+    # Load and warm up the models of a serving config (see serving_config).
+    # Failures are logged and reported, not raised, so one bad entry doesn't
+    # keep the others from loading.
+    def preload(self, specs) -> list:
+        results = []
+        for spec in specs:
+            try:
+                info = self.load(spec['local_path'], spec['cloud_path'], spec['model_arch'],
+                                 spec['classes_length'], pin=spec['pin'], warmup=spec['warmup'])
+                log(f"Preloaded {spec['model_arch']} {spec['cloud_path'] or spec['local_path']} "
+                    f"({info.get('bytes', 0) / 1e6:.1f} MB{', pinned' if spec['pin'] else ''}) "
+                    f"in {info['load_seconds'] + info['warmup_seconds']:.2f}s")
+                results.append({**spec, **info, 'status': 'loaded'})
+            except Exception as e:
+                log(f"Failed to preload {spec['cloud_path'] or spec['local_path']}: {e}")
+                results.append({**spec, 'status': 'failed', 'error': str(e)})
+        return results
+
+    # A model was retrained and saved to these paths: drop its cached
+    # results and resident copies (and the cached weight files, so the new
+    # ones are fetched without waiting for the weight cache TTL). Pinned
+    # models are reloaded, and warmed up, in the background.
+    def model_retrained(self, local_path: str = None, cloud_path: str = None):
+        local_path = os.path.abspath(local_path) if local_path else None
+
+        def matches(key):
+            key_cloud, key_local = key[0], key[1]
+            return bool((cloud_path and key_cloud == cloud_path)
+                        or (local_path and key_local and os.path.abspath(key_local) == local_path))
+
+        dropped = result_cache.invalidate_model(matches)
+        reload = []
+        for entry in model_cache.entries():
+            if matches(entry['key']) and model_cache.discard(entry['key']) and entry['pinned']:
+                reload.append(entry['key'])
+        if cloud_path and cloud_path.startswith("gs://"):
+            for uri in (cloud_path, sibling_path(cloud_path, SCRIPT_SUFFIX),
+                        sibling_path(cloud_path, INT8_SUFFIX)):
+                weight_cache.invalidate(uri)
+        log(f"Model retrained ({cloud_path or local_path}): dropped {dropped} cached results, "
+            f"reloading {len(reload)} pinned models")
+
+        def reload_pinned():
+            for key_cloud, key_local, model_arch, classes_length, _ in reload:
+                try:
+                    self.load(key_local, key_cloud, model_arch, classes_length, pin=True)
+                except Exception as e:
+                    log(f"Failed to reload pinned model {key_cloud or key_local}: {e}")
+
+        if reload:
+            threading.Thread(target=reload_pinned, name="reload-pinned", daemon=True).start()
+
+    def stats(self) -> dict:
+        return self.batcher.stats()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,164 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import TRAIN_JOBS, TRAIN_STAGE_SECONDS
+from progress import follow_events
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'train_model.py')
+
+
+# Last n lines of a text file
+def tail(path: str, n: int = 20):
+    try:
+        with open(path, 'r', errors='replace') as f:
+            return list(deque((line.rstrip('\n') for line in f), maxlen=n))
+    except FileNotFoundError:
+        return []
+
+
+class TrainingJob:
+    def __init__(self, job_id, model_name, classes, model_arch, file_name, jobs_dir, extra_args=()):
+        self.id = job_id
+        self.model_name = model_name
+        self.classes = classes
+        self.model_arch = model_arch
+        self.file_name = file_name
+        self.extra_args = list(extra_args)
+        self.status = 'queued'
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.log_path = os.path.join(jobs_dir, f"{job_id}.log")
+        self.result_path = os.path.join(jobs_dir, f"{job_id}.result.json")
+        self.events_path = os.path.join(jobs_dir, f"{job_id}.events.ndjson")
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    # Latest progress event written by the training process
+    def latest_event(self):
+        for line in reversed(tail(self.events_path, 2)):
+            try:
+                return json.loads(line)
+            except json.JSONDecodeError:
+                continue  # line still being written
+        return None
+
+    # Stream progress events as they are written, until the job finishes
+    def events(self, poll_interval: float = 0.5):
+        return follow_events(self.events_path, lambda: self.finished, poll_interval)
+
+    def to_dict(self):
+        now = time.time()
+        data = {
+            'jobId': self.id,
+            'status': self.status,
+            'modelName': self.model_name,
+            'modelArch': self.model_arch,
+            'modelPath': self.file_name,
+            'createdAt': self.created_at,
+            'startedAt': self.started_at,
+            'finishedAt': self.finished_at,
+            'elapsed': ((self.finished_at or now) - self.started_at) if self.started_at else 0.0,
+        }
+        if self.status == 'running':
+            data['logTail'] = tail(self.log_path)
+        if self.started_at:
+            data['progress'] = self.latest_event()
+        if self.result:
+            data['cloudPath'] = self.result.get('cloud_path')
+            data['localPath'] = self.result.get('local_path')
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+# Runs train_model.py jobs in the background on a bounded pool.
+#
+# Each job is a separate train_model.py process (so a crash or CUDA OOM
+# can't take the server down) writing its output to <id>.log and its
+# result to its own <id>.result.json, so concurrent trainings never share
+# files. At most max_concurrent jobs run at once; the rest stay queued.
+# on_success(job), if given, is called once a job's model has been saved.
+class JobManager:
+    def __init__(self, jobs_dir: str, max_concurrent: int = 1, on_success=None):
+        self.jobs_dir = jobs_dir
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.on_success = on_success
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent,
+                                            thread_name_prefix="train")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, model_name, classes, model_arch, file_name, extra_args=()):
+        job = TrainingJob(uuid.uuid4().hex, model_name, classes, model_arch,
+                          file_name, self.jobs_dir, extra_args)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    # Feed the job's 'stage' progress events into the training histograms
+    @staticmethod
+    def _record_stages(job):
+        try:
+            with open(job.events_path, 'r') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if event.get('type') == 'stage':
+                        TRAIN_STAGE_SECONDS.observe(event['seconds'], stage=event['stage'])
+        except FileNotFoundError:
+            pass
+
+    def _run(self, job):
+        job.status = 'running'
+        job.started_at = time.time()
+        cmd = [sys.executable, TRAIN_SCRIPT, job.model_name, str(job.classes),
+               job.model_arch, job.file_name, '--result-file', job.result_path,
+               '--progress-file', job.events_path] + job.extra_args
+        print(f"[job {job.id}] Running: {' '.join(cmd)}")
+        try:
+            with open(job.log_path, 'w') as log:
+                proc = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT,
+                                      cwd=os.path.dirname(TRAIN_SCRIPT))
+            if proc.returncode != 0:
+                raise RuntimeError(f"train_model.py exited with code {proc.returncode}:\n"
+                                   + '\n'.join(tail(job.log_path)))
+            with open(job.result_path, 'r') as f:
+                job.result = json.load(f)
+            job.status = 'succeeded'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            TRAIN_JOBS.inc(status=job.status)
+            self._record_stages(job)
+            print(f"[job {job.id}] {job.status} after {job.finished_at - job.started_at:.1f}s")
+        if job.status == 'succeeded' and self.on_success is not None:
+            try:
+                self.on_success(job)
+            except Exception as e:
+                print(f"[job {job.id}] on_success hook failed: {e}")
@@ -0,0 +1,147 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from sub-millisecond forwards to long uploads
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(labelnames, values, extra=None) -> str:
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+                lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f'{self.name}_sum{labels} {_format_value(series[-2])}')
+                lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+# Minimal Prometheus text-format registry. Besides its own counters and
+# histograms it can render collector callbacks, which turn existing stats
+# dicts (caches, batcher) into metric lines at scrape time.
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collect in self._collectors:
+            lines.extend(collect())
+        return '\n'.join(lines) + '\n'
+
+
+# Render a flat stats dict as one metric per numeric field
+def stats_lines(prefix: str, stats: dict, counters=()):
+    lines = []
+    for field, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f'{prefix}_{field}' + ('_total' if field in counters else '')
+        kind = 'counter' if field in counters else 'gauge'
+        lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{name} {_format_value(value)}')
+    return lines
+
+
+REGISTRY = Registry()
+
+CLASSIFY_STAGE_SECONDS = REGISTRY.histogram(
+    'ptm_classify_stage_seconds', 'Time spent in each classification stage', ('stage', 'source'))
+TRAIN_STAGE_SECONDS = REGISTRY.histogram(
+    'ptm_train_stage_seconds', 'Time spent in each training stage', ('stage',))
+CLASSIFY_REQUESTS = REGISTRY.counter(
+    'ptm_classify_requests_total', 'Classification HTTP requests', ('endpoint', 'status'))
+CLASSIFY_IMAGES = REGISTRY.counter(
+    'ptm_classify_images_total', 'Images classified', ('status',))
+TRAIN_JOBS = REGISTRY.counter(
+    'ptm_train_jobs_total', 'Finished training jobs', ('status',))
+
+
+# Time a block into `histogram`; if a timings dict is given, also add the
+# elapsed seconds under `stage` for a per-request breakdown
+@contextmanager
+def timed(histogram, stage: str, timings: dict = None, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, stage=stage, **labels)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
@@ -0,0 +1,30 @@
+import copy
+import os
+
+import torch
+
+# Optimized artifacts are stored next to the model's .pth, locally and in GCS
+SCRIPT_SUFFIX = '.ts.pt'
+INT8_SUFFIX = '.int8.pt'
+INT8_REPORT_SUFFIX = '.int8.json'
+# What the model was trained on, for incremental retraining (incremental.py)
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+# Path of an artifact stored next to a model file; works for local paths
+# and gs:// URIs alike, e.g. models/cats.pth -> models/cats.int8.pt
+def sibling_path(path: str, suffix: str) -> str:
+    root, _ = os.path.splitext(path)
+    return root + suffix
+
+
+# Save a self-contained TorchScript copy of a trained model (architecture
+# and weights) that loads with torch.jit.load, without rebuilding the
+# architecture through torchvision
+def export_torchscript(model, path: str, image_size: int = 224) -> str:
+    fp32 = copy.deepcopy(model).cpu().eval()
+    example = torch.zeros(1, 3, image_size, image_size)
+    with torch.no_grad():
+        scripted = torch.jit.trace(fp32, example)
+    torch.jit.save(scripted, path)
+    return path
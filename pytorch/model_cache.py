@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+# Approximate in-memory size of a model: parameters plus buffers
+def model_nbytes(model) -> int:
+    total = 0
+    for t in list(model.parameters()) + list(model.buffers()):
+        total += t.numel() * t.element_size()
+    return total
+
+
+# In-memory LRU registry of built, eval-mode models.
+# Entries are evicted least-recently-used first once the summed parameter
+# bytes go over max_bytes. Pinned entries are never evicted (they still
+# count against the budget). Concurrent requests for a model that is still
+# loading wait on the same load instead of each downloading it again.
+class ModelCache:
+    def __init__(self, max_bytes: int = 1024 * 1024 * 1024):
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (model, nbytes)
+        self._loading = {}             # key -> Future shared by waiters
+        self._pinned = set()
+        self._loaded_at = {}           # key -> (loaded_at, last_used)
+        self.hits = 0
+        self.misses = 0
+        self.shared_loads = 0
+        self.evictions = 0
+
+    # Return the model for `key`, calling loader() on a miss. With pin=True
+    # the entry is pinned as well, whether it was already resident or not.
+    def get(self, key, loader, pin: bool = False):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._loaded_at[key] = (self._loaded_at[key][0], time.time())
+                self.hits += 1
+                if pin:
+                    self._pinned.add(key)
+                return entry[0]
+            pending = self._loading.get(key)
+            if pending is not None:
+                self.shared_loads += 1
+                owner = False
+            else:
+                self.misses += 1
+                pending = Future()
+                self._loading[key] = pending
+                owner = True
+
+        if not owner:
+            model = pending.result()
+            if pin:
+                self.pin(key)
+            return model
+
+        try:
+            model = loader()
+        except BaseException as e:
+            with self._lock:
+                self._loading.pop(key, None)
+            pending.set_exception(e)
+            raise
+
+        nbytes = model_nbytes(model)
+        with self._lock:
+            self._loading.pop(key, None)
+            self._entries[key] = (model, nbytes)
+            now = time.time()
+            self._loaded_at[key] = (now, now)
+            if pin:
+                self._pinned.add(key)
+            self._evict()
+        pending.set_result(model)
+        return model
+
+    # Drop least-recently-used unpinned entries until we're back under
+    # budget. The most recent entry is always kept, even if it alone is too big.
+    def _evict(self):
+        newest = next(reversed(self._entries), None)
+        for key in list(self._entries):
+            if self._total_bytes() <= self.max_bytes:
+                break
+            if key == newest or key in self._pinned:
+                continue
+            self._drop(key)
+            self.evictions += 1
+
+    def _drop(self, key):
+        self._pinned.discard(key)
+        self._loaded_at.pop(key, None)
+        return self._entries.pop(key, None) is not None
+
+    def _total_bytes(self) -> int:
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    # Pin a resident model so eviction skips it; False if it isn't loaded
+    def pin(self, key) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._pinned.add(key)
+            return True
+
+    def unpin(self, key) -> bool:
+        with self._lock:
+            if key not in self._pinned:
+                return False
+            self._pinned.discard(key)
+            self._evict()
+            return True
+
+    # Remove a model, pinned or not
+    def discard(self, key) -> bool:
+        with self._lock:
+            return self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self._loaded_at.clear()
+
+    # Resident models, least recently used first
+    def entries(self) -> list:
+        with self._lock:
+            return [{'key': key, 'bytes': nbytes, 'pinned': key in self._pinned,
+                     'loaded_at': self._loaded_at[key][0], 'last_used': self._loaded_at[key][1]}
+                    for key, (_, nbytes) in self._entries.items()]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes(),
+                'pinned': len(self._pinned),
+                'pinned_bytes': sum(self._entries[key][1] for key in self._pinned),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'shared_loads': self.shared_loads,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,57 @@
+from io import BytesIO
+
+import torch
+from PIL import Image
+from torchvision.io import ImageReadMode, decode_jpeg
+from torchvision.transforms import functional as F
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+# Open an image for decoding at no less than min_side x min_side. Large
+# JPEGs are decoded at 1/2, 1/4 or 1/8 scale straight from the DCT
+# coefficients (PIL draft mode), which is much cheaper than decoding at
+# full size and resizing afterwards.
+def open_image(fp, min_side: int = 256) -> Image.Image:
+    img = Image.open(fp)
+    if img.format == "JPEG":
+        img.draft("RGB", (min_side, min_side))
+    return img.convert("RGB")
+
+
+# Decode encoded image bytes into a uint8 (3, H, W) tensor with both sides
+# at least min_side (when the source is that large). Small JPEGs go
+# through torchvision's decoder, large ones are draft-decoded by PIL.
+def decode_image(data: bytes, min_side: int = 256) -> torch.Tensor:
+    img = Image.open(BytesIO(data))
+    if img.format == "JPEG" and min(img.size) < 2 * min_side:
+        try:
+            return decode_jpeg(torch.frombuffer(bytearray(data), dtype=torch.uint8),
+                               mode=ImageReadMode.RGB)
+        except RuntimeError:
+            pass  # e.g. CMYK or progressive variants libjpeg-turbo rejects; PIL copes
+    return F.pil_to_tensor(open_image(BytesIO(data), min_side))
+
+
+# Inference geometry on a uint8 tensor: shorter side to `resize`, then the
+# central crop x crop square (same as Resize(256) + CenterCrop(224))
+def resize_center_crop(img: torch.Tensor, resize: int = 256, crop: int = 224) -> torch.Tensor:
+    return F.center_crop(F.resize(img, resize, antialias=True), crop)
+
+
+# Convert a uint8 (N, 3, H, W) batch to normalized float in one pass on
+# whatever device it lives on. Float batches are returned unchanged, so
+# callers can mix this with datasets that normalize per sample.
+def normalize_batch(batch: torch.Tensor) -> torch.Tensor:
+    if batch.dtype != torch.uint8:
+        return batch
+    mean = torch.tensor(IMAGENET_MEAN, device=batch.device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device=batch.device).view(1, 3, 1, 1)
+    return batch.float().div_(255).sub_(mean).div_(std)
+
+
+# Encoded images -> normalized float (N, 3, crop, crop) batch
+def preprocess_batch(images, resize: int = 256, crop: int = 224) -> torch.Tensor:
+    return normalize_batch(torch.stack(
+        [resize_center_crop(decode_image(data, resize), resize, crop) for data in images]))
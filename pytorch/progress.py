@@ -0,0 +1,61 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Machine-readable training progress channel: one JSON object per line
+# (NDJSON), appended and flushed as it happens so another process can follow
+# the file. With no path every emit() is a no-op.
+class ProgressReporter:
+    def __init__(self, path: str = None):
+        self.path = path
+        self._file = open(path, 'a', buffering=1) if path else None
+        self._lock = threading.Lock()  # background uploads report stages too
+
+    def emit(self, event_type: str, **fields):
+        if self._file is None:
+            return
+        event = {'type': event_type, 'time': time.time(), **fields}
+        with self._lock:
+            self._file.write(json.dumps(event) + '\n')
+            self._file.flush()
+
+    # Time a block and report it as a 'stage' event
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit('stage', stage=name, seconds=time.perf_counter() - start)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# Follow an NDJSON file, yielding each complete event as it is written.
+# Stops once `finished()` is true and everything written so far was read.
+def follow_events(path: str, finished, poll_interval: float = 0.5):
+    buffer = ''
+    position = 0
+    while True:
+        done = finished()
+        try:
+            with open(path, 'r') as f:
+                f.seek(position)
+                chunk = f.read()
+                position = f.tell()
+        except FileNotFoundError:
+            chunk = ''
+        buffer += chunk
+        while '\n' in buffer:
+            line, buffer = buffer.split('\n', 1)
+            if line.strip():
+                yield json.loads(line)
+        if done and not chunk:
+            return
+        if not chunk:
+            time.sleep(poll_interval)
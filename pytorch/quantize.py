@@ -0,0 +1,105 @@
+import copy
+import json
+
+import torch
+import torch.nn as nn
+from torchvision.models import quantization as qmodels
+
+
+# Pick the int8 kernel backend for this CPU (fbgemm on x86, qnnpack on ARM)
+def select_quantized_engine() -> str:
+    engines = torch.backends.quantized.supported_engines
+    engine = 'fbgemm' if 'fbgemm' in engines else 'qnnpack'
+    torch.backends.quantized.engine = engine
+    return engine
+
+
+# Quantization-ready copy of a trained model: torchvision's quantizable
+# variant of the architecture (same parameter names, plus quant/dequant
+# stubs) with the trained weights loaded
+def build_quantizable(arch: str, num_classes: int, state_dict):
+    if arch == 'resnet50':
+        model = qmodels.resnet50(weights=None, quantize=False)
+    elif arch == 'googlenet':
+        model = qmodels.googlenet(weights=None, quantize=False, aux_logits=False,
+                                  init_weights=False, transform_input=True)
+    elif arch == 'mobilenet_v2':
+        model = qmodels.mobilenet_v2(weights=None, quantize=False)
+    else:
+        raise ValueError(f"Unsupported architecture: {arch}")
+    if hasattr(model, 'fc'):
+        model.fc = nn.Linear(model.fc.in_features, num_classes)
+    else:
+        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+# Static post-training quantization of backbone and head: fuse conv/bn/relu,
+# observe activation ranges on the calibration batches, convert to int8
+def quantize_static(model, arch: str, num_classes: int, calibration_batches):
+    state_dict = {k: v.detach().cpu() for k, v in model.state_dict().items()}
+    qmodel = build_quantizable(arch, num_classes, state_dict)
+    qmodel.fuse_model()
+    qmodel.qconfig = torch.ao.quantization.get_default_qconfig(torch.backends.quantized.engine)
+    torch.ao.quantization.prepare(qmodel, inplace=True)
+    with torch.no_grad():
+        for inputs in calibration_batches:
+            qmodel(inputs)
+    torch.ao.quantization.convert(qmodel, inplace=True)
+    return qmodel
+
+
+# Dynamic quantization: int8 weights for the Linear head, activations
+# quantized on the fly; needs no calibration and works for any model
+def quantize_dynamic(model):
+    fp32 = copy.deepcopy(model).cpu().eval()
+    return torch.ao.quantization.quantize_dynamic(fp32, {nn.Linear}, dtype=torch.qint8)
+
+
+def accuracy(model, batches) -> float:
+    correct = total = 0
+    with torch.inference_mode():
+        for inputs, labels in batches:
+            correct += (model(inputs).argmax(1) == labels).sum().item()
+            total += labels.numel()
+    return correct / total if total else 0.0
+
+
+# Quantize a trained model, compare its accuracy with the fp32 model on
+# held-out labeled batches and save it as a self-contained TorchScript file
+# at `path`. The accuracy report is written next to it as JSON.
+def quantize_and_save(model, arch: str, num_classes: int, calibration_batches,
+                      eval_batches, path: str, report_path: str, mode: str = 'static'):
+    engine = select_quantized_engine()
+    fp32 = copy.deepcopy(model).cpu().eval()
+    if mode == 'static':
+        qmodel = quantize_static(fp32, arch, num_classes, calibration_batches)
+    elif mode == 'dynamic':
+        qmodel = quantize_dynamic(fp32)
+    else:
+        raise ValueError(f"Unsupported quantization mode: {mode}")
+
+    fp32_acc = accuracy(fp32, eval_batches)
+    int8_acc = accuracy(qmodel, eval_batches)
+
+    example = calibration_batches[0][:1]
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(qmodel, example).eval())
+    torch.jit.save(scripted, path)
+
+    report = {
+        'mode': mode,
+        'engine': engine,
+        'arch': arch,
+        'fp32_acc': fp32_acc,
+        'int8_acc': int8_acc,
+        'acc_delta': int8_acc - fp32_acc,
+        'eval_samples': sum(labels.numel() for _, labels in eval_batches),
+        'path': path,
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Quantized ({mode}, {engine}): fp32 acc {fp32_acc:.4f} -> int8 acc {int8_acc:.4f} "
+          f"(delta {report['acc_delta']:+.4f})")
+    return report
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Bounded LRU cache of classification results.
+#
+# Entries are keyed by (model key, weight digest, image key), where the
+# image key is either the image URL or a hash of the downloaded bytes, so
+# a result is only ever returned for the exact weights that produced it.
+# Entries expire `ttl` seconds after they were stored (URLs can be
+# overwritten upstream) and are dropped least-recently-used first beyond
+# max_entries. invalidate_model() drops every result of a model at once,
+# e.g. after it has been retrained.
+class ResultCache:
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600.0):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (model_key, digest, image_key) -> (result, stored_at)
+        self.url_hits = 0
+        self.content_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    # Cached result for one image, or None. `kind` only splits the hit
+    # counters ("url" or "content"); a lookup that is followed by another
+    # one for the same request passes count_miss=False, so the hit ratio
+    # is per request. A model that isn't loaded yet has no digest.
+    def get(self, model_key, digest, image_key, kind: str = 'url', count_miss: bool = True):
+        if not self.enabled:
+            return None
+        key = (model_key, digest, image_key)
+        with self._lock:
+            if digest is None:
+                self.misses += count_miss
+                return None
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] >= self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += count_miss
+                return None
+            self._entries.move_to_end(key)
+            if kind == 'content':
+                self.content_hits += 1
+            else:
+                self.url_hits += 1
+            return dict(entry[0])
+
+    # Store one result under each of the image's keys (URL, content hash)
+    def put(self, model_key, digest, image_keys, result: dict):
+        if not self.enabled or digest is None:
+            return
+        now = time.time()
+        with self._lock:
+            for image_key in image_keys:
+                if image_key is None:
+                    continue
+                key = (model_key, digest, image_key)
+                self._entries[key] = (dict(result), now)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Drop every result of the models whose key matches `predicate`
+    def invalidate_model(self, predicate) -> int:
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key[0])]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.url_hits + self.content_hits
+            lookups = hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': hits,
+                'url_hits': self.url_hits,
+                'content_hits': self.content_hits,
+                'misses': self.misses,
+                'hit_ratio': hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,81 @@
+import json
+import os
+import random
+import time
+
+from torch.utils.data import Subset
+from torch.utils.data.dataloader import default_collate
+
+
+# Persistent list of image URLs that can't be used (undecodable, 4xx,
+# too large). Entries are appended as one JSON line each, so DataLoader
+# worker processes can add to it concurrently; the main process reload()s
+# it so later epochs, and later runs, skip those URLs without fetching them.
+class Quarantine:
+    def __init__(self, path: str):
+        self.path = path
+        self.urls = set()
+        self.reload()
+
+    def reload(self):
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        self.urls.add(json.loads(line)['url'])
+                    except (json.JSONDecodeError, KeyError):
+                        continue
+        except FileNotFoundError:
+            pass
+        return self
+
+    def add(self, url: str, reason: str):
+        if url in self.urls:
+            return
+        self.urls.add(url)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'url': url, 'reason': reason, 'time': time.time()}) + '\n')
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+
+# Subset that keeps batches full: when a sample fails to load (the dataset
+# returns (None, None)), another sample from the same subset is drawn in
+# its place, preferably of the same class so the class balance holds.
+# Substitutes never come from outside the subset, so the train/val split
+# stays clean.
+class RefillSubset(Subset):
+    def __init__(self, dataset, indices, max_refills: int = 5):
+        super().__init__(dataset, indices)
+        self.max_refills = max_refills
+        targets = getattr(dataset, 'targets', None)
+        self._by_class = {}
+        if targets is not None:
+            for pos, idx in enumerate(self.indices):
+                self._by_class.setdefault(int(targets[idx]), []).append(pos)
+
+    def __getitem__(self, pos):
+        sample = self.dataset[self.indices[pos]]
+        if sample[0] is not None:
+            return sample
+        targets = getattr(self.dataset, 'targets', None)
+        pool = self._by_class.get(int(targets[self.indices[pos]])) if targets is not None else None
+        for _ in range(self.max_refills):
+            sample = self.dataset[self.indices[random.choice(pool or range(len(self.indices)))]]
+            if sample[0] is not None:
+                return sample
+        return sample
+
+
+# Collate that drops failed (None) samples instead of crashing on them.
+# A batch in which every sample failed comes out as (None, None).
+def skip_none_collate(batch):
+    batch = [sample for sample in batch if sample[0] is not None]
+    if not batch:
+        return None, None
+    return default_collate(batch)
@@ -1,19 +1,78 @@
 import time
-import subprocess
-import uuid
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
+from concurrent.futures import as_completed
 import json
 import os
+import threading
 
-import sys
+from inference_engine import InferenceEngine
+from jobs import TRAIN_SCRIPT, JobManager
+from metrics import REGISTRY, CLASSIFY_REQUESTS, CLASSIFY_STAGE_SECONDS, stats_lines, timed
+from classify_image import image_fetcher, model_cache, result_cache, weight_cache
+from serving_config import load_serving_config
 
 app = Flask(__name__)
 
+# Number of concurrent classification workers kept warm in this process
+CLASSIFY_WORKERS = int(os.getenv('CLASSIFY_WORKERS', '4'))
+# Concurrent requests for the same model are run as one forward pass
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '5'))
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', '0'))
+# "optimized" serves int8 models (falling back to channels_last fp32)
+INFERENCE_MODE = os.getenv('INFERENCE_MODE', 'default')
+engine = InferenceEngine(workers=CLASSIFY_WORKERS, threads=INFERENCE_THREADS,
+                         max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                         optimized=INFERENCE_MODE == 'optimized')
+
+# Models to load, warm up and optionally pin at startup (see serving_config.py)
+SERVING_CONFIG = os.getenv('SERVING_CONFIG', '')
+# When set, /admin requests must carry it in an X-Admin-Token header
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+preload_results = []
+
+
+def preload_models():
+    try:
+        specs = load_serving_config(SERVING_CONFIG)
+    except (OSError, ValueError) as e:
+        print(f"Not preloading models: {e}")
+        return
+    print(f"Preloading {len(specs)} models from {SERVING_CONFIG}")
+    preload_results.extend(engine.preload(specs))
+
+
+# Preload on a background thread so the server accepts requests meanwhile
+# (requests for a model still loading wait on that same load). Skipped in
+# the debug reloader's parent process, which never serves requests.
+if SERVING_CONFIG and not (__name__ == '__main__' and not os.environ.get('WERKZEUG_RUN_MAIN')):
+    threading.Thread(target=preload_models, name='preload', daemon=True).start()
+
+# Training runs in the background, at most TRAIN_CONCURRENCY at a time
+TRAIN_CONCURRENCY = int(os.getenv('TRAIN_CONCURRENCY', '1'))
+JOBS_DIR = os.getenv('JOBS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs'))
+
+
+# A finished training run replaced the model's weights: stop serving
+# cached results and resident copies of the old ones
+def model_retrained(job):
+    local_path = job.result.get('local_path')
+    if local_path:
+        local_path = os.path.join(os.path.dirname(TRAIN_SCRIPT), local_path)
+    engine.model_retrained(local_path, job.result.get('cloud_path'))
+
+
+jobs = JobManager(JOBS_DIR, max_concurrent=TRAIN_CONCURRENCY, on_success=model_retrained)
+
 @app.route('/train', methods=['POST'])
 def train_model():
     model_name = request.json.get('modelName')  
     classes = request.json.get('classes')  
     model_arch=request.json.get("modelArch")
+    # fine-tune the previous version of this model on new images only
+    incremental = bool(request.json.get('incremental'))
+    # continue from the checkpoint of an earlier run of this model that died
+    resume = bool(request.json.get('resume'))
 
     if not model_name:
         return jsonify({'error': 'Model name is required'}), 400
@@ -22,29 +81,47 @@ def train_model():
 
     try:
         file_name = f"{model_name}.pth" 
-        
-        # Run the training script
-        subprocess.run(['python3', 'train_model.py', model_name, str(classes), model_arch, file_name], check=True)
 
-        # Read the cloud path from the temporary file
-        cloud_path = None
-        try:
-            with open('model_cloud_path.txt', 'r') as f:
-                cloud_path = f.read().strip()
-            # Clean up the temporary file
-            os.remove('model_cloud_path.txt')
-        except Exception as e:
-            print(f"Error reading cloud path: {str(e)}")
-        
-        return jsonify({
-            'modelPath': file_name,
-            'cloudPath': cloud_path
-        }), 200
+        # Queue the training run and return right away; poll /train/<jobId>
+        job = jobs.submit(model_name, classes, model_arch, file_name,
+                          extra_args=(['--incremental'] if incremental else [])
+                                     + (['--resume'] if resume else []))
+        return jsonify(job.to_dict()), 202
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/train/<job_id>', methods=['GET'])
+def train_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown training job: {job_id}'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+# Live training progress, one event per epoch and per N batches.
+# Server-Sent Events by default; ?format=ndjson for one JSON object per line.
+@app.route('/train/<job_id>/events', methods=['GET'])
+def train_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown training job: {job_id}'}), 404
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for event in job.events():
+                yield json.dumps(event) + '\n'
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    def generate_sse():
+        for event in job.events():
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        yield f"event: end\ndata: {json.dumps(job.to_dict())}\n\n"
+    return Response(generate_sse(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/classify', methods=['POST'])
 def classify():
     try:
@@ -80,45 +157,27 @@ def classify():
         if not os.path.exists(local_path):
             print(f"Warning: Local path does not exist: {local_path}")
 
-        cmd = [
-            'python', 'classify_image.py',
-            image_url, local_path, cloud_path,
-            model_arch, str(classes_length)
-        ]
-        print(f"Running command: {' '.join(cmd)}")
-
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        print("Script stdout:", result.stdout)
-        print("Script stderr:", result.stderr)
-
-        # grab only the last line (the JSON) for parsing
-        out_lines = result.stdout.strip().splitlines()
-        json_line = out_lines[-1] if out_lines else ""
+        # Optional per-stage timing breakdown in the response
+        timings = {} if data.get('timings') else None
+        start = time.perf_counter()
         try:
-            classification_result = json.loads(json_line)
-            return jsonify(classification_result), 200
-        except json.JSONDecodeError as e:
-            error_msg = (
-                f"Failed to parse classification result: {e}\n"
-                f"Output was:\n{result.stdout}"
+            classification_result = engine.classify(
+                image_url, local_path, cloud_path,
+                model_arch, classes_length, timings
             )
+        except Exception as e:
+            error_msg = f"Classification error: {e}"
             print(error_msg)
             return jsonify({'error': error_msg}), 500
 
-    except subprocess.CalledProcessError as e:
-        error_msg = (
-            f"Classification script error:\n"
-            f"Command: {' '.join(e.cmd)}\n"
-            f"Exit code: {e.returncode}\n"
-            f"Output: {e.output}\nStderr: {e.stderr}"
-        )
-        print(error_msg)
-        return jsonify({'error': error_msg}), 500
+        with timed(CLASSIFY_STAGE_SECONDS, 'serialize', timings):
+            body = json.dumps(classification_result)
+        total = time.perf_counter() - start
+        CLASSIFY_STAGE_SECONDS.observe(total, stage='total')
+        if timings is not None:
+            timings['total'] = total
+            body = json.dumps({**classification_result, 'timings': timings})
+        return Response(body, mimetype='application/json'), 200
 
     except Exception as e:
         error_msg = f"Server error: {e}\nFull error: {repr(e)}"
@@ -126,6 +185,148 @@ def classify():
         return jsonify({'error': error_msg}), 500
 
 
+@app.route('/classify/batch', methods=['POST'])
+def classify_batch():
+    data = request.json or {}
+
+    image_urls    = data.get('image_urls')   or []
+    local_path    = data.get('local_path')   or ""
+    cloud_path    = data.get('cloud_path')   or ""
+    model_arch    = data.get('model_arch')   or ""
+    classes_length= data.get('classes_length')
+
+    if not isinstance(image_urls, list) or not all(isinstance(u, str) and u for u in image_urls):
+        return jsonify({'error': 'image_urls must be a non-empty list of URLs'}), 400
+    missing = [k for k, v in {
+        'image_urls': image_urls,
+        'local_path': local_path,
+        'model_arch': model_arch,
+        'classes_length': classes_length
+    }.items() if not v]
+    if missing:
+        return jsonify({'error': f"Missing required parameters: {', '.join(missing)}"}), 400
+    try:
+        classes_length = int(classes_length)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'classes_length must be an integer'}), 400
+
+    print(f"Batch classification of {len(image_urls)} images with {model_arch} ({cloud_path or local_path})")
+
+    # Queue every image up front so downloads run concurrently and the
+    # batcher can group them; results stream back as NDJSON in completion order
+    futures = {
+        engine.submit(url, local_path, cloud_path, model_arch, classes_length): (i, url)
+        for i, url in enumerate(image_urls)
+    }
+
+    def generate():
+        for future in as_completed(futures):
+            index, url = futures[future]
+            try:
+                line = {'index': index, 'image_url': url, **future.result()}
+            except Exception as e:
+                line = {'index': index, 'image_url': url, 'error': str(e)}
+            yield json.dumps(line) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+# Model identity fields of an admin request; returns (spec, error message)
+def admin_model_spec(data):
+    spec = {
+        'local_path': data.get('local_path') or "",
+        'cloud_path': data.get('cloud_path') or "",
+        'model_arch': data.get('model_arch') or "",
+    }
+    missing = [k for k in ('local_path', 'model_arch') if not spec[k]]
+    if not data.get('classes_length'):
+        missing.append('classes_length')
+    if missing:
+        return None, f"Missing required parameters: {', '.join(missing)}"
+    try:
+        spec['classes_length'] = int(data.get('classes_length'))
+    except (TypeError, ValueError):
+        return None, 'classes_length must be an integer'
+    return spec, None
+
+
+@app.before_request
+def check_admin_token():
+    if request.path.startswith('/admin/') and ADMIN_TOKEN \
+            and request.headers.get('X-Admin-Token') != ADMIN_TOKEN:
+        return jsonify({'error': 'Invalid admin token'}), 403
+
+
+# Resident models with their memory footprint and pin state, plus the
+# outcome of the startup preload
+@app.route('/admin/models', methods=['GET'])
+def admin_list_models():
+    return jsonify({
+        'models': engine.resident_models(),
+        'preload': preload_results,
+        'model_cache': model_cache.stats(),
+    }), 200
+
+
+# Load (and by default warm up) a model; `pin: true` keeps it resident
+@app.route('/admin/models/load', methods=['POST'])
+def admin_load_model():
+    data = request.json or {}
+    spec, error = admin_model_spec(data)
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        info = engine.load(**spec, pin=bool(data.get('pin')), warmup=data.get('warmup', True) is not False)
+    except Exception as e:
+        return jsonify({'error': f"Failed to load model: {e}"}), 500
+    return jsonify(info), 200
+
+
+@app.route('/admin/models/unload', methods=['POST'])
+def admin_unload_model():
+    spec, error = admin_model_spec(request.json or {})
+    if error:
+        return jsonify({'error': error}), 400
+    if not engine.unload(**spec):
+        return jsonify({'error': 'Model is not loaded'}), 404
+    return jsonify({'unloaded': spec}), 200
+
+
+@app.after_request
+def count_classify_requests(response):
+    if request.endpoint in ('classify', 'classify_batch'):
+        CLASSIFY_REQUESTS.inc(endpoint=request.endpoint, status=response.status_code)
+    return response
+
+
+REGISTRY.add_collector(lambda: stats_lines(
+    'ptm_model_cache', model_cache.stats(), counters=('hits', 'misses', 'shared_loads', 'evictions')))
+REGISTRY.add_collector(lambda: stats_lines(
+    'ptm_weight_cache', weight_cache.stats(), counters=('hits', 'absent_hits', 'revalidated', 'downloads', 'evictions')))
+REGISTRY.add_collector(lambda: stats_lines(
+    'ptm_batcher', engine.stats(), counters=('batches', 'items')))
+REGISTRY.add_collector(lambda: stats_lines(
+    'ptm_result_cache', result_cache.stats(),
+    counters=('hits', 'url_hits', 'content_hits', 'misses', 'evictions', 'invalidations')))
+REGISTRY.add_collector(lambda: stats_lines(
+    'ptm_image_fetcher', image_fetcher.stats(),
+    counters=('hits', 'misses', 'coalesced', 'too_large', 'timeouts', 'errors')))
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'model_cache': model_cache.stats(),
+        'weight_cache': weight_cache.stats(),
+        'batcher': engine.stats(),
+        'image_fetcher': image_fetcher.stats(),
+        'result_cache': result_cache.stats(),
+    }), 200
 
 
 if __name__ == '__main__':
@@ -0,0 +1,43 @@
+import json
+
+REQUIRED_FIELDS = ('local_path', 'model_arch', 'classes_length')
+
+
+# Models the server makes resident at startup, read from a JSON file:
+#
+#   {"models": [{"local_path": "models/shoes.pth",
+#                "cloud_path": "gs://ptm_models/models/shoes.pth",
+#                "model_arch": "resnet50", "classes_length": 3,
+#                "pin": true}]}
+#
+# `cloud_path` is optional; `pin` (default false) keeps the model out of
+# LRU eviction and `warmup` (default true) runs dummy batches through it.
+# Returns the list of normalized entries; raises ValueError on a bad file.
+def load_serving_config(path: str) -> list:
+    with open(path, 'r') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid serving config {path}: {e}")
+    models = data.get('models') if isinstance(data, dict) else data
+    if not isinstance(models, list):
+        raise ValueError(f"Serving config {path} must hold a list of models")
+
+    specs = []
+    for i, entry in enumerate(models):
+        missing = [k for k in REQUIRED_FIELDS if not (isinstance(entry, dict) and entry.get(k))]
+        if missing:
+            raise ValueError(f"Serving config entry {i} is missing {', '.join(missing)}")
+        try:
+            classes_length = int(entry['classes_length'])
+        except (TypeError, ValueError):
+            raise ValueError(f"Serving config entry {i}: classes_length must be an integer")
+        specs.append({
+            'local_path': entry['local_path'],
+            'cloud_path': entry.get('cloud_path') or '',
+            'model_arch': entry['model_arch'],
+            'classes_length': classes_length,
+            'pin': bool(entry.get('pin', False)),
+            'warmup': bool(entry.get('warmup', True)),
+        })
+    return specs
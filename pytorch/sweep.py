@@ -0,0 +1,198 @@
+import itertools
+import json
+import multiprocessing as mp
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from image_cache import ImageCache, prefetch_images
+from model_cache import model_nbytes
+from progress import ProgressReporter
+from robust_data import Quarantine
+from tensor_store import TensorStoreDataset, build_tensor_store
+from train_model import (DATASET_CACHE_DIR, PREFETCH_WORKERS, TENSOR_STORE_DIR, device,
+                         setup_model, train_model)
+
+# Per-trial logs, weights and the sweep report
+SWEEP_DIR = os.getenv('SWEEP_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'sweeps'))
+
+
+def sweep_configs(archs, lrs, batch_sizes):
+    return [{'trial': f'{arch}-lr{lr:g}-bs{bs}', 'arch': arch, 'lr': lr, 'batch_size': bs}
+            for arch, lr, bs in itertools.product(archs, lrs, batch_sizes)]
+
+
+# Median stopping rule: after `grace` epochs, a trial stops once its best
+# validation accuracy so far is below the median of the best accuracies
+# the other trials had reached by the same epoch
+def should_stop(curves: dict, trial: str, epoch: int, grace: int = 2) -> bool:
+    if epoch + 1 < grace:
+        return False
+    others = [max(curve[:epoch + 1]) for other, curve in curves.items()
+              if other != trial and len(curve) > epoch]
+    if len(others) < 2:
+        return False
+    return max(curves[trial]) < statistics.median(others)
+
+
+# Pool initializer: split the cores between trials, one GPU per worker
+def _init_worker(threads: int, gpu_ids):
+    torch.set_num_threads(threads)
+    if gpu_ids is not None:
+        torch.cuda.set_device(gpu_ids.get())
+
+
+# One sweep trial, run in a pool process. Reads the shared memory-mapped
+# tensor store with the sweep's fixed split, publishes its validation
+# curve in `curves` (shared with the other trials) and stops when the
+# median rule says it's falling behind. Output goes to <trial>.log.
+def run_trial(config, image_urls, split, curves, sweep_dir, max_epochs, patience, grace):
+    trial = config['trial']
+    log_path = os.path.join(sweep_dir, f'{trial}.log')
+    weights_path = os.path.join(sweep_dir, f'{trial}.pth')
+    state = {'stopped_early': False}
+
+    def on_epoch(epoch, val_acc):
+        curves[trial] = list(curves.get(trial, [])) + [val_acc]
+        state['stopped_early'] = should_stop(dict(curves), trial, epoch, grace)
+        return state['stopped_early']
+
+    with open(log_path, 'w', buffering=1) as log, redirect_stdout(log), redirect_stderr(log):
+        model = setup_model(config['arch'], len(image_urls))
+        optimizer = optim.Adam(model.parameters(), lr=config['lr'])
+        start = time.time()
+        model = train_model(model, image_urls, nn.CrossEntropyLoss(), optimizer, patience=patience,
+                            use_tensor_store=True, progress_every=0, max_epochs=max_epochs,
+                            batch_size=config['batch_size'], split=split, num_workers=1,
+                            on_epoch=on_epoch)
+        train_time = time.time() - start
+        torch.save(model.state_dict(), weights_path)
+    curve = list(curves.get(trial, []))
+    return {**config, 'best_acc': max(curve, default=0.0), 'epochs': len(curve),
+            'stopped_early': state['stopped_early'], 'train_time': train_time,
+            'weights_path': weights_path, 'log_path': log_path}
+
+
+# Median single-image forward latency in ms, measured on its own so the
+# trials are compared on an idle machine
+def measure_latency(model, runs: int = 20) -> float:
+    model.eval()
+    x = torch.randn(1, 3, 224, 224, device=device)
+    times = []
+    with torch.inference_mode():
+        for i in range(runs + 3):
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            model(x)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            if i >= 3:  # warm-up
+                times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def format_table(results) -> str:
+    header = (f"{'trial':<28} {'arch':<13} {'lr':>8} {'batch':>5} {'best_acc':>8} {'epochs':>6} "
+              f"{'stopped':>7} {'train_s':>8} {'latency_ms':>10} {'size_mb':>7}")
+    lines = [header, '-' * len(header)]
+    for r in results:
+        if 'error' in r:
+            lines.append(f"{r['trial']:<28} failed: {r['error']}")
+            continue
+        lines.append(f"{r['trial']:<28} {r['arch']:<13} {r['lr']:>8g} {r['batch_size']:>5d} "
+                     f"{r['best_acc']:>8.4f} {r['epochs']:>6d} {'early' if r['stopped_early'] else '':>7} "
+                     f"{r['train_time']:>8.1f} {r['latency_ms']:>10.2f} {r['bytes'] / 1e6:>7.1f}")
+    return '\n'.join(lines)
+
+
+# Train every (arch, lr, batch size) combination on the same data and
+# compare them. Images are downloaded and decoded once into a tensor store
+# that all trials memory-map read-only, with one fixed train/val split.
+# Trials run `workers` at a time in separate processes (one per GPU, or
+# splitting the CPU cores); weak ones are stopped early by the median rule.
+# Returns the results, best first, and writes them to <sweep_dir>/report.json.
+def run_sweep(name, image_urls, archs, lrs, batch_sizes, workers=None, max_epochs=10,
+              patience=3, grace=2, progress=None, seed=0):
+    if progress is None:
+        progress = ProgressReporter()
+    configs = sweep_configs(archs, lrs, batch_sizes)
+    sweep_dir = os.path.join(SWEEP_DIR, name)
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    image_cache = ImageCache(DATASET_CACHE_DIR)
+    quarantine = Quarantine(os.path.join(image_cache.cache_dir, 'quarantine.ndjson'))
+    with progress.stage('image_prefetch'):
+        local_paths = prefetch_images(image_urls, image_cache, workers=PREFETCH_WORKERS,
+                                      quarantine=quarantine)
+    with progress.stage('tensor_store_build'):
+        store_dir = build_tensor_store(image_urls, local_paths, TENSOR_STORE_DIR,
+                                       quarantine=quarantine)
+    indices = list(range(len(TensorStoreDataset(store_dir, None))))
+    random.Random(seed).shuffle(indices)
+    cut = int(0.8 * len(indices))
+    split = (indices[:cut], indices[cut:])
+    # fetch each architecture's pretrained weights once, before the trials
+    # race to download them
+    for arch in dict.fromkeys(archs):
+        setup_model(arch, len(image_urls))
+
+    cpus = os.cpu_count() or 1
+    gpus = torch.cuda.device_count() if device.type == 'cuda' else 0
+    if workers is None:
+        workers = gpus or max(1, cpus // 4)
+    workers = max(1, min(workers, len(configs), gpus or workers))
+    threads = max(1, cpus // workers)
+    print(f"\n=== SWEEP: {len(configs)} trials, {workers} at a time, {threads} threads each ===")
+
+    ctx = mp.get_context('spawn')
+    results = []
+    with ctx.Manager() as manager:
+        curves = manager.dict()
+        gpu_ids = None
+        if gpus:
+            gpu_ids = manager.Queue()
+            for i in range(workers):
+                gpu_ids.put(i % gpus)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(threads, gpu_ids)) as pool:
+            futures = {pool.submit(run_trial, config, image_urls, split, curves, sweep_dir,
+                                   max_epochs, patience, grace): config
+                       for config in configs}
+            for future in as_completed(futures):
+                config = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {**config, 'error': str(e)}
+                print(f"Trial {config['trial']} finished: "
+                      + (f"failed ({result['error']})" if 'error' in result
+                         else f"best acc {result['best_acc']:.4f} after {result['epochs']} epochs"))
+                progress.emit('trial', **result)
+                results.append(result)
+
+    with progress.stage('sweep_latency'):
+        for result in results:
+            if 'error' in result:
+                continue
+            model = setup_model(result['arch'], len(image_urls), pretrained=False)
+            model.load_state_dict(torch.load(result['weights_path'], map_location=device))
+            result['latency_ms'] = measure_latency(model)
+            result['bytes'] = model_nbytes(model)
+
+    results.sort(key=lambda r: ('error' in r, -r.get('best_acc', 0.0), r.get('latency_ms', 0.0)))
+    print(f"\n=== SWEEP RESULTS ===\n{format_table(results)}")
+    report_path = os.path.join(sweep_dir, 'report.json')
+    with open(report_path, 'w') as f:
+        json.dump({'name': name, 'classes': list(image_urls), 'results': results}, f, indent=2)
+    print(f"Report written to {report_path}")
+    progress.emit('sweep', report=report_path, best=results[0] if results else None)
+    return results
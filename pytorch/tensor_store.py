@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+from preprocessing import open_image
+
+
+# Identify a dataset by its classes and URLs, so a store is only reused for
+# exactly the same images in the same order
+def dataset_key(image_urls, salt: str = "") -> str:
+    h = hashlib.sha256(salt.encode("utf-8"))
+    for cls, urls in image_urls.items():
+        h.update(f"\n#{cls}".encode("utf-8"))
+        for url in urls:
+            h.update(f"\n{url}".encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+# One-time pass that decodes every locally cached image, resizes it to
+# size x size and writes it into a single uint8 (N, size, size, 3) .npy
+# file that can be memory-mapped, next to labels.npy and index.json.
+# Returns the store directory; an existing complete store is reused.
+def build_tensor_store(image_urls, local_paths, root_dir: str, size: int = 256,
+                       quarantine=None) -> str:
+    store_dir = os.path.join(root_dir, dataset_key(image_urls, f"size={size}"))
+    index_path = os.path.join(store_dir, "index.json")
+    if os.path.exists(index_path):
+        print(f"Using existing tensor store {store_dir}")
+        return store_dir
+
+    items = [(label, url) for label, urls in enumerate(image_urls.values())
+             for url in urls if url in local_paths]
+    print(f"\n=== Building tensor store for {len(items)} images ===")
+    os.makedirs(store_dir, exist_ok=True)
+    images_path = os.path.join(store_dir, "images.npy")
+    images = np.lib.format.open_memmap(images_path + ".part", mode="w+",
+                                       dtype=np.uint8, shape=(len(items), size, size, 3))
+    labels = []
+    urls = []
+    for label, url in items:
+        try:
+            img = open_image(local_paths[url], size).resize((size, size), Image.BILINEAR)
+        except Exception as e:
+            print(f"[ERROR] decoding {url}: {e}")
+            if quarantine is not None:
+                quarantine.add(url, str(e))
+            continue
+        images[len(labels)] = np.asarray(img)
+        labels.append(label)
+        urls.append(url)
+    images.flush()
+    del images
+    os.replace(images_path + ".part", images_path)
+    np.save(os.path.join(store_dir, "labels.npy"), np.asarray(labels, dtype=np.int64))
+
+    # index.json is written last and marks the store as complete
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"classes": list(image_urls), "size": size, "count": len(labels), "urls": urls}, f)
+    os.replace(index_path + ".tmp", index_path)
+    print(f"Tensor store written to {store_dir} ({len(labels)} images)")
+    return store_dir
+
+
+# Dataset over a tensor store. Rows are read straight from the memory-mapped
+# file, so DataLoader workers share the page cache instead of each holding
+# decoded copies, and only the tensor transforms run per sample.
+class TensorStoreDataset(Dataset):
+    def __init__(self, store_dir: str, transform):
+        self.store_dir = store_dir
+        self.transform = transform
+        with open(os.path.join(store_dir, "index.json"), "r") as f:
+            self.index = json.load(f)
+        self.labels = np.load(os.path.join(store_dir, "labels.npy"))
+        self.targets = self.labels
+        self.urls = self.index["urls"]
+        # opened lazily so each worker process maps the file itself
+        self._images = None
+
+    def __len__(self):
+        return self.index["count"]
+
+    def __getitem__(self, idx):
+        if self._images is None:
+            # copy-on-write mapping: zero-copy reads, writable for torch
+            self._images = np.load(os.path.join(self.store_dir, "images.npy"), mmap_mode="c")
+        img = torch.from_numpy(self._images[idx]).permute(2, 0, 1)
+        return self.transform(img), int(self.labels[idx])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
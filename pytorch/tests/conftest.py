@@ -0,0 +1,5 @@
+import os
+import sys
+
+# modules are imported by their top-level names, as the scripts in pytorch/ do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,84 @@
+import cloudinary_listing
+from benchmarks.fakes import FakeCloudinaryApi
+from cloudinary_listing import list_dataset, list_delta, list_full, prefix_expression
+
+PREFIX = 'dataset/shoes/boots'
+
+
+def urls(name, n):
+    return [f'https://res.example.com/{name}_{i}.jpg' for i in range(n)]
+
+
+def api_with(n):
+    api = FakeCloudinaryApi()
+    api.add_images('shoes', {'boots': urls('old', n), 'bootsy': urls('other', 3)})
+    return api
+
+
+def test_full_listing_stays_under_the_prefix():
+    api = api_with(250)
+    resources = list_full(api, PREFIX, page_size=100)
+    assert len(resources) == 250
+    assert all(r['public_id'].startswith(PREFIX + '/') for r in resources)
+
+
+def test_delta_stops_at_the_first_known_id():
+    api = api_with(500)
+    known = list_full(api, PREFIX)
+    api.add_images('shoes', {'boots': urls('new', 3)})
+    api.calls = 0
+    new = list_delta(api, PREFIX, known, page_size=100)
+    assert sorted(r['secure_url'] for r in new) == sorted(urls('new', 3))
+    # newest first, so one page covers the new uploads; the 500 known aren't paged through
+    assert api.calls == 1
+
+
+def test_delta_pages_until_a_known_id():
+    api = api_with(10)
+    known = list_full(api, PREFIX)
+    api.add_images('shoes', {'boots': urls('new', 25)})
+    api.calls = 0
+    new = list_delta(api, PREFIX, known, page_size=10)
+    assert len(new) == 25
+    assert api.calls == 3
+
+
+def test_empty_search_is_confirmed_with_the_admin_api():
+    api = api_with(20)
+    known = list_full(api, PREFIX)
+    api.add_images('shoes', {'boots': urls('new', 2)}, indexed=False)
+    new = list_delta(api, PREFIX, known)
+    assert sorted(r['secure_url'] for r in new) == sorted(urls('new', 2))
+
+
+def test_nothing_new():
+    api = api_with(20)
+    known = list_full(api, PREFIX)
+    api.calls = 0
+    assert list_delta(api, PREFIX, known) == []
+    # one search page and one Admin API page
+    assert api.calls == 2
+
+
+def test_prefix_expression_escapes_reserved_characters():
+    assert prefix_expression('dataset/shoes/boots/') == 'public_id:dataset/shoes/boots/*'
+    assert prefix_expression('dataset/my shoes/a:b/') == r'public_id:dataset/my\ shoes/a\:b/*'
+
+
+def test_rate_limited_requests_are_retried(monkeypatch):
+    monkeypatch.setattr(cloudinary_listing.time, 'sleep', lambda s: None)
+    api = api_with(30)
+    api.rate_limit_every = 2
+    assert len(list_full(api, PREFIX, page_size=10)) == 30
+
+
+def test_fresh_manifest_is_refreshed_with_a_delta(tmp_path):
+    api = api_with(20)
+    image_urls, manifest = list_dataset('shoes', ['boots'], str(tmp_path), api=api)
+    assert len(image_urls['boots']) == 20
+    revision = manifest.data['revision']
+
+    api.add_images('shoes', {'boots': urls('new', 2)})
+    image_urls, manifest = list_dataset('shoes', ['boots'], str(tmp_path), api=api)
+    assert len(image_urls['boots']) == 22
+    assert manifest.data['revision'] == revision + 1
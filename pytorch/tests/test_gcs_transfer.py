@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+import gcs_transfer
+from benchmarks.fakes import FakeStorageClient
+from gcs_transfer import MAX_COMPOSE_PARTS, ChecksumError
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def bucket():
+    client = FakeStorageClient()
+    bucket = client.bucket('ptm_models')
+    bucket.blob('models/big.pth').upload_from_string(DATA)
+    return bucket
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_sliced_download_reassembles_ranges(tmp_path, bucket):
+    path = str(tmp_path / 'big.pth')
+    gcs_transfer.download(bucket.get_blob('models/big.pth'), path, workers=4,
+                          slice_size=1000, threshold=1000)
+    assert read(path) == DATA
+    # 10 full slices and a 240 byte tail, each a ranged read
+    assert bucket.client.downloads == 11
+    assert bucket.client.bytes_downloaded == len(DATA)
+
+
+def test_small_blob_is_downloaded_whole(tmp_path, bucket):
+    path = str(tmp_path / 'big.pth')
+    gcs_transfer.download(bucket.get_blob('models/big.pth'), path, threshold=len(DATA) + 1)
+    assert read(path) == DATA
+    assert bucket.client.downloads == 1
+
+
+def test_slices_cover_the_file_once():
+    pieces = gcs_transfer._slices(10240, 1000)
+    assert pieces[0] == (0, 1000)
+    assert pieces[-1] == (10000, 240)
+    assert sum(length for _, length in pieces) == 10240
+    assert len(gcs_transfer._slices(10240, 1, MAX_COMPOSE_PARTS)) <= MAX_COMPOSE_PARTS
+
+
+def test_md5_mismatch_removes_the_file(tmp_path, bucket):
+    blob = bucket.get_blob('models/big.pth')
+    blob.crc32c = None
+    blob.md5_hash = 'not-the-md5'
+    path = str(tmp_path / 'big.pth')
+    with pytest.raises(ChecksumError, match='md5'):
+        gcs_transfer.download(blob, path, workers=4, slice_size=1000, threshold=1000)
+    assert not os.path.exists(path)
+
+
+def test_size_mismatch_is_detected(tmp_path, bucket):
+    blob = bucket.get_blob('models/big.pth')
+    blob.size = len(DATA) - 1
+    path = str(tmp_path / 'big.pth')
+    with pytest.raises(ChecksumError, match='Size'):
+        gcs_transfer.download(blob, path, threshold=len(DATA) + 1)
+    assert not os.path.exists(path)
+
+
+def test_crc32c_is_preferred_over_md5(tmp_path, bucket):
+    pytest.importorskip('google_crc32c')
+    blob = bucket.get_blob('models/big.pth')
+    path = str(tmp_path / 'big.pth')
+    gcs_transfer.download(blob, path, workers=4, slice_size=1000, threshold=1000)
+    # composite objects have no md5; crc32c alone must verify them
+    blob.md5_hash = None
+    gcs_transfer.verify(blob, path)
+    blob.crc32c = 'AAAAAA=='
+    with pytest.raises(ChecksumError, match='crc32c'):
+        gcs_transfer.verify(blob, path)
+
+
+def test_upload_composes_at_most_32_parts(tmp_path, bucket):
+    path = tmp_path / 'model.pth'
+    path.write_bytes(DATA)
+    # 1 byte slices would be 10240 parts; they're widened to fit one compose
+    blob = gcs_transfer.upload(bucket, 'models/model.pth', str(path), workers=8,
+                               slice_size=1, threshold=1)
+    assert bucket.get_blob('models/model.pth').download_as_bytes() == DATA
+    assert blob.size == len(DATA)
+    # the parts are deleted once composed
+    assert [b.name for b in bucket.list_blobs('models/model.pth')] == ['models/model.pth']
+
+
+def test_small_upload_is_a_single_object(tmp_path, bucket):
+    path = tmp_path / 'model.pth'
+    path.write_bytes(b'small')
+    gcs_transfer.upload(bucket, 'models/model.pth', str(path))
+    assert bucket.get_blob('models/model.pth').download_as_bytes() == b'small'
@@ -0,0 +1,92 @@
+import pytest
+
+import weight_cache
+from benchmarks.fakes import FakeStorageClient
+from weight_cache import WeightCache
+
+URI = 'gs://ptm_models/models/shoes.pth'
+TS_URI = 'gs://ptm_models/models/shoes.ts.pt'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(weight_cache.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def client():
+    client = FakeStorageClient()
+    client.bucket('ptm_models').blob('models/shoes.pth').upload_from_string(b'weights v1')
+    client.metadata_requests = 0
+    return client
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_hit_within_ttl_costs_no_request(tmp_path, clock, client):
+    cache = WeightCache(str(tmp_path), ttl=60, client=client)
+    path = cache.fetch(URI)
+    clock.now += 59
+    assert cache.fetch(URI) == path
+    assert client.metadata_requests == 1
+    assert client.downloads == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_expired_entry_is_revalidated_without_download(tmp_path, clock, client):
+    cache = WeightCache(str(tmp_path), ttl=60, client=client)
+    path = cache.fetch(URI)
+    clock.now += 60
+    assert cache.fetch(URI) == path
+    assert client.metadata_requests == 2
+    assert client.downloads == 1
+    assert cache.stats()['revalidated'] == 1
+
+
+def test_new_generation_is_downloaded_after_expiry(tmp_path, clock, client):
+    cache = WeightCache(str(tmp_path), ttl=60, client=client)
+    old_path = cache.fetch(URI)
+    client.bucket('ptm_models').blob('models/shoes.pth').upload_from_string(b'weights v2')
+    # still within the TTL: the cached generation is served
+    assert read(cache.fetch(URI)) == b'weights v1'
+    clock.now += 61
+    new_path = cache.fetch(URI)
+    assert new_path != old_path
+    assert read(new_path) == b'weights v2'
+    assert cache.stats()['entries'] == 1
+
+
+def test_missing_blob_is_cached_for_the_ttl(tmp_path, clock, client):
+    cache = WeightCache(str(tmp_path), ttl=60, client=client)
+    for _ in range(3):
+        with pytest.raises(FileNotFoundError):
+            cache.fetch(TS_URI)
+    assert client.metadata_requests == 1
+    assert cache.stats()['absent_hits'] == 2
+
+    client.bucket('ptm_models').blob('models/shoes.ts.pt').upload_from_string(b'script')
+    clock.now += 60
+    assert read(cache.fetch(TS_URI)) == b'script'
+    assert cache.stats()['absent'] == 0
+
+
+def test_invalidate_forgets_missing_blob(tmp_path, clock, client):
+    cache = WeightCache(str(tmp_path), ttl=60, client=client)
+    with pytest.raises(FileNotFoundError):
+        cache.fetch(TS_URI)
+    client.bucket('ptm_models').blob('models/shoes.ts.pt').upload_from_string(b'script')
+    cache.invalidate(TS_URI)
+    assert read(cache.fetch(TS_URI)) == b'script'
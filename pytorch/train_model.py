@@ -1,5 +1,7 @@
 import sys
 import os
+import argparse
+import json
 import random
 import cloudinary
 import cloudinary.api
@@ -7,9 +9,9 @@ import cloudinary.uploader
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, Subset, TensorDataset
+from concurrent.futures import ThreadPoolExecutor
 from torchvision import models, transforms
-from PIL import Image
 import requests
 from io import BytesIO
 from dotenv import load_dotenv
@@ -20,6 +22,24 @@ from urllib3.util.retry import Retry
 import torch.backends.cudnn as cudnn
 from torch.cuda.amp import GradScaler, autocast
 
+from image_cache import ImageCache, prefetch_images
+from image_fetcher import UnusableImage
+from tensor_store import TensorStoreDataset, build_tensor_store, dataset_key
+from feature_cache import extract_features, head_module
+from progress import ProgressReporter
+from eval_metrics import ConfusionMatrix
+from robust_data import Quarantine, RefillSubset, skip_none_collate
+import gcs_transfer
+from checkpoint import (load_checkpoint, rng_state, save_checkpoint, set_rng_state,
+                        snapshot_state_dict)
+from cloudinary_listing import list_dataset
+from preprocessing import normalize_batch, open_image, preprocess_batch
+from model_artifacts import (INT8_REPORT_SUFFIX, INT8_SUFFIX, MANIFEST_SUFFIX, SCRIPT_SUFFIX,
+                             export_torchscript, sibling_path)
+from incremental import (diff_listing, expand_head, incremental_urls, load_manifest,
+                         replay_sample, save_manifest)
+from quantize import quantize_and_save
+
 # Load environment variables
 load_dotenv()
 
@@ -36,10 +56,38 @@ cloudinary.config(
     api_secret=os.getenv('ApiSecret'),
 )
 
+# Local content-addressed copies of dataset images, shared across runs
+DATASET_CACHE_DIR = os.getenv('DATASET_CACHE_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'images'))
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '16'))
+# Pre-decoded, memory-mapped uint8 datasets (see tensor_store.py)
+TENSOR_STORE_DIR = os.getenv('TENSOR_STORE_DIR',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'tensor_stores'))
+# Per-model Cloudinary listing manifests (see cloudinary_listing.py); a
+# class is listed in full again once its listing is LISTING_MAX_AGE old
+LISTING_CACHE_DIR = os.getenv('LISTING_CACHE_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'listings'))
+LISTING_WORKERS = int(os.getenv('LISTING_WORKERS', '4'))
+LISTING_MAX_AGE = float(os.getenv('LISTING_MAX_AGE', str(24 * 3600)))
+# Parallel sliced GCS transfers (see gcs_transfer.py); uploads can also run
+# in the background while the script exports, quantizes and writes manifests
+GCS_TRANSFER_WORKERS = int(os.getenv('GCS_TRANSFER_WORKERS', '8'))
+BACKGROUND_UPLOAD = os.getenv('TRAIN_BACKGROUND_UPLOAD', '') == '1'
+_upload_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload')
+_pending_uploads = []
+# Periodic training checkpoints, one per output model (see --resume)
+CHECKPOINT_DIR = os.getenv('CHECKPOINT_DIR',
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'checkpoints'))
+# Backbone embeddings for cached-feature (head-only) training
+FEATURE_CACHE_DIR = os.getenv('FEATURE_CACHE_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'features'))
+
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 cudnn.benchmark = True  # Enable cuDNN autotuner for optimized kernels
 
-# Data transforms
+# PIL-input transforms for CloudinaryDataset. Samples come out as uint8
+# tensors, like the tensor store's; whole batches are converted and
+# normalized on the training device by normalize_batch.
 def get_transforms():
     train_transform = transforms.Compose([
         transforms.Resize((256, 256)),
@@ -48,25 +96,44 @@ def get_transforms():
         transforms.RandomRotation(15),
         transforms.ColorJitter(0.2, 0.2, 0.2, 0.1),
         transforms.RandomAffine(0, translate=(0.1, 0.1), scale=(0.9, 1.1)),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        transforms.PILToTensor(),
     ])
     val_transform = transforms.Compose([
         transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        transforms.PILToTensor(),
+    ])
+    return train_transform, val_transform
+
+# Tensor-input transforms for TensorStoreDataset: images arrive as uint8
+# (3, 256, 256) tensors that are already resized, so only augmentation is
+# left. Samples stay uint8; whole batches are converted and normalized on
+# the training device by normalize_batch.
+def get_tensor_transforms():
+    train_transform = transforms.Compose([
+        transforms.RandomResizedCrop(224, antialias=True),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(15),
+        transforms.ColorJitter(0.2, 0.2, 0.2, 0.1),
+        transforms.RandomAffine(0, translate=(0.1, 0.1), scale=(0.9, 1.1)),
     ])
+    val_transform = transforms.Resize((224, 224), antialias=True)
     return train_transform, val_transform
 
 # Top-level dataset class for pickling
 class CloudinaryDataset(Dataset):
-    def __init__(self, image_urls, transform, is_training=True):
+    def __init__(self, image_urls, transform, is_training=True, local_paths=None, quarantine=None):
         self.image_urls = image_urls
         self.transform = transform
         self.is_training = is_training
+        # local copies from the prefetch stage, {url: path}
+        self.local_paths = local_paths or {}
+        self.class_to_idx = {cls: i for i, cls in enumerate(image_urls)}
         # flatten (class, url) pairs
         self.items = [(cls, url) for cls, urls in image_urls.items() for url in urls]
-        # HTTP session with retries
+        self.targets = [self.class_to_idx[cls] for cls, _ in self.items]
+        # known-bad URLs are never fetched; new failures are added to it
+        self.quarantine = quarantine
+        # HTTP session with retries, only used for images missing from the cache
         self.session = requests.Session()
         retries = Retry(total=5, backoff_factor=2,
                         status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
@@ -78,54 +145,67 @@ class CloudinaryDataset(Dataset):
 
     def __getitem__(self, idx):
         cls, url = self.items[idx]
+        if self.quarantine is not None and url in self.quarantine:
+            return None, None
         try:
-            r = self.session.get(url, timeout=None)
-            if r.status_code != 200 or 'image' not in r.headers.get('Content-Type', ''):
-                raise ValueError(f"Invalid response for URL: {url}")
-            img = Image.open(BytesIO(r.content)).convert('RGB')
+            path = self.local_paths.get(url)
+            if path:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            else:
+                r = self.session.get(url, timeout=30)
+                if r.status_code == 429 or r.status_code >= 500:
+                    raise requests.HTTPError(f"HTTP {r.status_code} for URL: {url}")
+                if r.status_code != 200 or 'image' not in r.headers.get('Content-Type', ''):
+                    raise UnusableImage(f"Invalid response for URL: {url}")
+                data = r.content
+            try:
+                img = open_image(BytesIO(data))
+            except OSError as e:
+                # the bytes are in memory, so this is PIL failing to identify or decode them
+                raise UnusableImage(f"Undecodable image: {e}") from e
             img = self.transform(img)
-            label = list(self.image_urls.keys()).index(cls)
+            label = self.class_to_idx[cls]
             return img, label
         except Exception as e:
             print(f"[ERROR] {cls} @ {url}: {e}")
+            # only the image itself is quarantined; network and cache I/O errors
+            # may be transient, and anything else is a bug, not a bad image
+            if self.quarantine is not None and isinstance(e, UnusableImage):
+                self.quarantine.add(url, str(e))
             return None, None
 
-# Fetch image URLs for each class (all pages)
-def get_image_urls_from_cloudinary(model_name, class_names):
-    image_urls = {}
-    for cls in class_names:
-        print(f"\n=== FETCHING CLASS: {cls} ===")
-        urls = []
-        next_cursor = None
-        while True:
-            params = {
-                'type': 'upload',
-                'prefix': f"dataset/{model_name}/{cls}",
-                'max_results': 500
-            }
-            if next_cursor:
-                params['next_cursor'] = next_cursor
-            res = cloudinary.api.resources(**params)
-            fetched = res.get('resources', [])
-            print(f"  Fetched {len(fetched)} images")
-            urls.extend([r['secure_url'] for r in fetched])
-            next_cursor = res.get('next_cursor')
-            if not next_cursor:
-                break
+# Rows of cached features for the given dataset indices, minus samples
+# that failed to load during extraction (label -1)
+def feature_rows(feats, labels, indices):
+    indices = torch.as_tensor(indices, dtype=torch.long)
+    keep = indices[labels[indices] >= 0]
+    return TensorDataset(feats[keep], labels[keep])
+
+# Fetch image URLs for each class: listed concurrently and kept in a local
+# per-model manifest, so later runs only fetch new uploads
+def get_image_urls_from_cloudinary(model_name, class_names, api=None, force_full=False):
+    image_urls, _ = list_dataset(model_name, class_names, LISTING_CACHE_DIR, api=api,
+                                 workers=LISTING_WORKERS, max_age=LISTING_MAX_AGE,
+                                 force_full=force_full)
+    for cls, urls in image_urls.items():
         print(f"Total images for class '{cls}': {len(urls)}")
         if len(urls) < 10:
             raise ValueError(f"Class {cls} has insufficient images (<10)")
-        image_urls[cls] = urls
     return image_urls
 
 # Initialize model
-def setup_model(arch, num_classes):
+def setup_model(arch, num_classes, pretrained=True):
     if arch == 'resnet50':
-        model = models.resnet50(pretrained=True)
+        model = models.resnet50(pretrained=pretrained)
     elif arch == 'googlenet':
-        model = models.googlenet(pretrained=True)
+        if pretrained:
+            model = models.googlenet(pretrained=True)
+        else:
+            # same layout as the pretrained model: no aux heads, transformed input
+            model = models.googlenet(aux_logits=False, init_weights=False, transform_input=True)
     elif arch == 'mobilenet_v2':
-        model = models.mobilenet_v2(pretrained=True)
+        model = models.mobilenet_v2(pretrained=pretrained)
     else:
         raise ValueError(f"Unsupported architecture: {arch}")
     print(f"Training model: {arch}")
@@ -138,10 +218,24 @@ def setup_model(arch, num_classes):
     return model.to(device)
 
 # Training loop with speed enhancements
-def train_model(model, image_urls, criterion, optimizer, target_accuracy=0.95, patience=5):
+def train_model(model, image_urls, criterion, optimizer, target_accuracy=0.95, patience=5,
+                image_cache=None, use_tensor_store=False, feature_augs=None,
+                progress=None, progress_every=10, max_epochs=None,
+                checkpoint_path=None, checkpoint_every=1, resume=False,
+                batch_size=None, split=None, num_workers=None, on_epoch=None):
+    if progress is None:
+        progress = ProgressReporter()
+    # A checkpoint is only resumed for the same images, training mode and
+    # architecture (class name + parameter count tells resnet18 from resnet50)
+    arch_key = f"{type(model).__name__}/{sum(p.numel() for p in model.parameters())}"
+    run_key = dataset_key(image_urls, f"arch={arch_key}/features={feature_augs}"
+                                      f"/tensor_store={bool(use_tensor_store)}")
+    ckpt = load_checkpoint(checkpoint_path) if resume else None
+    if ckpt is not None and ckpt.get('run_key') != run_key:
+        print(f"Checkpoint {checkpoint_path} is for a different run, starting over")
+        ckpt = None
     train_tf, val_tf = get_transforms()
     scaler = GradScaler()
-    best_wts = model.state_dict()
     best_acc = 0.0
     no_imp = 0
     epoch = 0
@@ -149,21 +243,52 @@ def train_model(model, image_urls, criterion, optimizer, target_accuracy=0.95, p
     print(f"\n=== Training Configuration ===\nTarget: {target_accuracy}, Patience: {patience}, Initial LR: {optimizer.param_groups[0]['lr']}")
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='max', factor=0.5, patience=3, verbose=True)
 
+    # Download every image once; both subsets and all epochs read local copies
+    if image_cache is None:
+        image_cache = ImageCache(DATASET_CACHE_DIR)
+    quarantine = Quarantine(os.path.join(image_cache.cache_dir, 'quarantine.ndjson'))
+    if len(quarantine):
+        print(f"Skipping {len(quarantine)} quarantined image URLs")
+    with progress.stage('image_prefetch'):
+        local_paths = prefetch_images(image_urls, image_cache, workers=PREFETCH_WORKERS,
+                                      quarantine=quarantine)
+
     # Build and split dataset
-    full_train = CloudinaryDataset(image_urls, train_tf, is_training=True)
+    if use_tensor_store:
+        with progress.stage('tensor_store_build'):
+            store_dir = build_tensor_store(image_urls, local_paths, TENSOR_STORE_DIR,
+                                           quarantine=quarantine)
+        train_tf, val_tf = get_tensor_transforms()
+        full_train = TensorStoreDataset(store_dir, train_tf)
+        full_val = TensorStoreDataset(store_dir, val_tf)
+    else:
+        full_train = CloudinaryDataset(image_urls, train_tf, is_training=True,
+                                       local_paths=local_paths, quarantine=quarantine)
+        full_val = CloudinaryDataset(image_urls, val_tf, is_training=False,
+                                     local_paths=local_paths, quarantine=quarantine)
     N = len(full_train)
-    indices = list(range(N))
-    random.shuffle(indices)
-    split = int(0.8 * N)
-    train_idx, val_idx = indices[:split], indices[split:]
+    if ckpt is not None:
+        train_idx, val_idx = ckpt['train_idx'], ckpt['val_idx']
+    elif split is not None:
+        # fixed split, e.g. shared by every trial of a sweep
+        train_idx, val_idx = split
+    else:
+        indices = list(range(N))
+        random.shuffle(indices)
+        split = int(0.8 * N)
+        train_idx, val_idx = indices[:split], indices[split:]
 
-    train_sub = torch.utils.data.Subset(full_train, train_idx)
-    full_val = CloudinaryDataset(image_urls, val_tf, is_training=False)
-    val_sub = torch.utils.data.Subset(full_val, val_idx)
+    # failed training samples are replaced by others from the same split and
+    # class, so batches stay full; failed validation samples are just skipped
+    # so no image is scored twice
+    train_sub = RefillSubset(full_train, train_idx)
+    val_sub = Subset(full_val, val_idx)
 
     # Determine batch size
     nS = len(train_sub)
-    if nS < 100:
+    if batch_size:
+        bs = min(batch_size, nS)
+    elif nS < 100:
         bs = min(8, nS)
     elif nS > 1000:
         bs = 64
@@ -171,67 +296,140 @@ def train_model(model, image_urls, criterion, optimizer, target_accuracy=0.95, p
         bs = 32
     print(f"Batch Size: {bs}, Train samples: {nS}, Val samples: {len(val_sub)}")
 
-    nw = min(4, os.cpu_count() or 1)
-    train_loader = DataLoader(train_sub, batch_size=bs, shuffle=True, num_workers=nw, pin_memory=True)
-    val_loader = DataLoader(val_sub, batch_size=bs, shuffle=False, num_workers=nw, pin_memory=True)
+    nw = min(4, os.cpu_count() or 1) if num_workers is None else num_workers
+
+    # Cached-feature mode: the backbone is frozen, so its embeddings are
+    # computed once and only the head trains on them. feature_augs=0 trains
+    # on un-augmented features; K > 0 rotates through K augmented views.
+    net = model
+    train_views = [train_sub]
+    if feature_augs is not None:
+        net = head_module(model)
+        feature_dir = os.path.join(FEATURE_CACHE_DIR, dataset_key(
+            image_urls, f"{type(model).__name__}/{type(full_val).__name__}"))
+        with progress.stage('feature_extract'):
+            val_feats, val_labels = extract_features(
+                model, full_val, os.path.join(feature_dir, 'val.pt'), device, num_workers=nw)
+        val_sub = feature_rows(val_feats, val_labels, val_idx)
+        if feature_augs == 0:
+            train_views = [feature_rows(val_feats, val_labels, train_idx)]
+        else:
+            train_views = []
+            for k in range(feature_augs):
+                with progress.stage('feature_extract'):
+                    feats, lbls = extract_features(
+                        model, full_train, os.path.join(feature_dir, f'aug{k}.pt'), device, num_workers=nw)
+                train_views.append(feature_rows(feats, lbls, train_idx))
+        train_sub = train_views[0]
+        nw = 0
+        print(f"Training head only on cached features ({len(train_views)} view(s))")
+
+    train_loaders = [DataLoader(view, batch_size=bs, shuffle=True, num_workers=nw, pin_memory=True,
+                                collate_fn=skip_none_collate)
+                     for view in train_views]
+    val_loader = DataLoader(val_sub, batch_size=bs, shuffle=False, num_workers=nw, pin_memory=True,
+                            collate_fn=skip_none_collate)
+    best_wts = snapshot_state_dict(net)
+    if ckpt is not None:
+        net.load_state_dict(ckpt['net'])
+        optimizer.load_state_dict(ckpt['optimizer'])
+        scheduler.load_state_dict(ckpt['scheduler'])
+        scaler.load_state_dict(ckpt['scaler'])
+        best_wts = ckpt['best_wts']
+        best_acc, no_imp, epoch = ckpt['best_acc'], ckpt['no_imp'], ckpt['epoch'] + 1
+        set_rng_state(ckpt['rng'])
+        progress.emit('resume', epoch=epoch, best_acc=best_acc, checkpoint=checkpoint_path)
+        print(f"Resuming from {checkpoint_path} at epoch {epoch} (best acc {best_acc:.4f})")
     start = time.time()
+    progress.emit('start', classes=list(image_urls), train_samples=len(train_sub),
+                  val_samples=len(val_sub), batch_size=bs, lr=optimizer.param_groups[0]['lr'])
     print("\n=== Starting Training ===")
     while True:
         print(f"\nEpoch {epoch}\n{'-'*10}")
         # Training phase
-        model.train()
-        running_loss = 0.0
-        running_corrects = 0
-        for inputs, labels in train_loader:
+        net.train()
+        # pick up URLs the previous epoch's workers quarantined
+        quarantine.reload()
+        train_metrics = ConfusionMatrix(len(image_urls), device)
+        train_loader = train_loaders[epoch % len(train_loaders)]
+        epoch_start = time.time()
+        data_time = compute_time = 0.0
+        window_images = 0
+        window_start = epoch_start
+        seen = 0
+        t0 = time.time()
+        for batch_idx, (inputs, labels) in enumerate(train_loader):
+            t1 = time.time()
+            data_time += t1 - t0
             if inputs is None:
+                t0 = time.time()
                 continue
-            inputs = inputs.to(device, non_blocking=True)
+            inputs = normalize_batch(inputs.to(device, non_blocking=True))
             labels = labels.to(device, non_blocking=True)
             optimizer.zero_grad()
             with autocast():
-                outputs = model(inputs)
+                outputs = net(inputs)
                 loss = criterion(outputs, labels)
             scaler.scale(loss).backward()
             scaler.step(optimizer)
             scaler.update()
-            preds = outputs.argmax(1)
-            running_loss += loss.item() * inputs.size(0)
-            running_corrects += (preds == labels).sum().item()
-        train_loss = running_loss / len(train_sub)
-        train_acc = running_corrects / len(train_sub)
+            train_metrics.update(outputs.argmax(1), labels, loss)
+            seen += inputs.size(0)
+            window_images += inputs.size(0)
+            t0 = time.time()
+            compute_time += t0 - t1
+            if progress_every and (batch_idx + 1) % progress_every == 0:
+                so_far = train_metrics.running()
+                progress.emit('batch', epoch=epoch, batch=batch_idx + 1, batches=len(train_loader),
+                              loss=so_far['loss'], acc=so_far['accuracy'],
+                              images_per_sec=window_images / max(t0 - window_start, 1e-9),
+                              data_time=data_time, compute_time=compute_time,
+                              lr=optimizer.param_groups[0]['lr'])
+                window_images = 0
+                window_start = t0
+        train_time = time.time() - epoch_start
+        progress.emit('stage', stage='train_data_wait', seconds=data_time)
+        progress.emit('stage', stage='train_compute', seconds=compute_time)
+        train_stats = train_metrics.running()
+        train_loss, train_acc = train_stats['loss'], train_stats['accuracy']
 
         # Validation phase
-        model.eval()
-        val_loss = 0.0
-        val_corrects = 0
-        class_corrects = [0] * len(image_urls)
-        class_totals = [0] * len(image_urls)
+        val_start = time.time()
+        net.eval()
+        val_metrics = ConfusionMatrix(len(image_urls), device)
         with torch.no_grad():
             for inputs, labels in val_loader:
                 if inputs is None:
                     continue
-                inputs = inputs.to(device, non_blocking=True)
+                inputs = normalize_batch(inputs.to(device, non_blocking=True))
                 labels = labels.to(device, non_blocking=True)
-                outputs = model(inputs)
-                loss = criterion(outputs, labels)
-                preds = outputs.argmax(1)
-                val_loss += loss.item() * inputs.size(0)
-                val_corrects += (preds == labels).sum().item()
-                for i, lbl in enumerate(labels):
-                    class_totals[lbl] += 1
-                    class_corrects[lbl] += int(preds[i] == lbl)
-        val_loss = val_loss / len(val_sub)
-        val_acc = val_corrects / len(val_sub)
+                outputs = net(inputs)
+                val_metrics.update(outputs.argmax(1), labels, criterion(outputs, labels))
+        val_report = val_metrics.compute(list(image_urls))
+        val_loss, val_acc = val_report['loss'], val_report['accuracy']
+        progress.emit('stage', stage='validation', seconds=time.time() - val_start)
 
         # Print metrics
         print(f'Train Loss: {train_loss:.4f} Acc: {train_acc:.4f}')
         print(f'Val Loss: {val_loss:.4f} Acc: {val_acc:.4f}')
-        print(f'Current LR: {optimizer.param_groups[0]['lr']}')
+        print(f"Current LR: {optimizer.param_groups[0]['lr']}")
         print('\nPer-class accuracy:')
-        for idx, cls in enumerate(image_urls):
-            if class_totals[idx] > 0:
-                acc_i = class_corrects[idx] / class_totals[idx]
-                print(f'  Class {cls}: {acc_i:.4f} ({class_corrects[idx]}/{class_totals[idx]})')
+        for cls, m in val_report['per_class'].items():
+            if m['support'] > 0:
+                print(f"  Class {cls}: {m['recall']:.4f} ({round(m['recall'] * m['support'])}/{m['support']})"
+                      f"  precision {m['precision']:.4f}  F1 {m['f1']:.4f}")
+
+        progress.emit('epoch', epoch=epoch, train_loss=train_loss, train_acc=train_acc,
+                      val_loss=val_loss, val_acc=val_acc,
+                      per_class_acc={cls: m['recall'] for cls, m in val_report['per_class'].items()
+                                     if m['support'] > 0},
+                      per_class_f1={cls: m['f1'] for cls, m in val_report['per_class'].items()
+                                    if m['support'] > 0},
+                      macro_f1=val_report['macro_f1'],
+                      lr=optimizer.param_groups[0]['lr'],
+                      images_per_sec=seen / max(train_time, 1e-9),
+                      data_time=data_time, compute_time=compute_time,
+                      epoch_time=time.time() - epoch_start)
 
         old_lr = optimizer.param_groups[0]['lr']
         scheduler.step(val_acc)
@@ -239,12 +437,12 @@ def train_model(model, image_urls, criterion, optimizer, target_accuracy=0.95, p
         if new_lr != old_lr:
             print(f'\nLearning rate adjusted: {old_lr} -> {new_lr}')
 
-        if val_acc >= target_accuracy:
-            print(f'\nReached target accuracy of {target_accuracy}!')
-            break
+        # caller-side hook, called for every epoch before any stopping check;
+        # returning True asks to stop, e.g. a sweep dropping a weak trial
+        stop_requested = on_epoch is not None and on_epoch(epoch, val_acc)
         if val_acc > best_acc:
             best_acc = val_acc
-            best_wts = model.state_dict()
+            best_wts = snapshot_state_dict(net)
             no_imp = 0
             print(f'New best accuracy: {best_acc:.4f}')
         else:
@@ -253,60 +451,358 @@ def train_model(model, image_urls, criterion, optimizer, target_accuracy=0.95, p
             if no_imp >= patience:
                 print(f'\nEarly stopping triggered after {patience} epochs')
                 break
+        # after the snapshot above, so the weights that reached it are returned
+        if val_acc >= target_accuracy:
+            print(f'\nReached target accuracy of {target_accuracy}!')
+            break
+        if stop_requested:
+            print('\nStopped early by the caller')
+            break
+        if checkpoint_path and checkpoint_every and (epoch + 1) % checkpoint_every == 0:
+            with progress.stage('checkpoint'):
+                save_checkpoint(checkpoint_path, {
+                    'run_key': run_key,
+                    'epoch': epoch,
+                    'net': net.state_dict(),
+                    'optimizer': optimizer.state_dict(),
+                    'scheduler': scheduler.state_dict(),
+                    'scaler': scaler.state_dict(),
+                    'best_wts': best_wts,
+                    'best_acc': best_acc,
+                    'no_imp': no_imp,
+                    'train_idx': train_idx,
+                    'val_idx': val_idx,
+                    'rng': rng_state(),
+                })
+        if max_epochs and epoch + 1 >= max_epochs:
+            print(f'\nReached max epochs ({max_epochs})')
+            break
         epoch += 1
 
+    progress.emit('done', epochs=epoch, best_acc=best_acc, final_acc=val_acc,
+                  total_time=time.time() - start)
     print(f"\n=== Training Summary ===\nTotal Time: {time.time() - start:.1f}s | Final Val Acc: {val_acc:.4f} | Best Val Acc: {best_acc:.4f} | Epochs: {epoch} | LR: {optimizer.param_groups[0]['lr']}")
-    model.load_state_dict(best_wts)
+    net.load_state_dict(best_wts)
     return model
 
 # Save model locally and to GCS
-def save_model(model, model_name, output_file):
+def save_model(model, model_name, output_file, progress=None, export=True):
+    if progress is None:
+        progress = ProgressReporter()
     models_dir = os.path.join(os.path.dirname(__file__), 'models')
     os.makedirs(models_dir, exist_ok=True)
     local_path = os.path.join(models_dir, output_file)
     print(f"Saving model locally to {local_path}...")
-    torch.save(model.state_dict(), local_path)
+    with progress.stage('save_local'):
+        torch.save(model.state_dict(), local_path)
     print("Model saved locally!")
+    if not export:
+        # an older export would be loaded instead of the new weights
+        remove_artifacts(local_path, (SCRIPT_SUFFIX,))
+    # same for an older int8 model; --quantize writes a new one after saving
+    remove_artifacts(local_path, (INT8_SUFFIX, INT8_REPORT_SUFFIX))
+
+    cloud_path = upload_to_gcs(local_path, output_file, progress)
+    paths = {'local_path': local_path, 'cloud_path': cloud_path}
+
+    # Self-contained TorchScript copy next to the .pth, so inference can
+    # load it without rebuilding the architecture
+    if export:
+        script_path = sibling_path(local_path, SCRIPT_SUFFIX)
+        print(f"Exporting TorchScript model to {script_path}...")
+        with progress.stage('export_torchscript'):
+            export_torchscript(model, script_path)
+        paths['script_path'] = script_path
+        paths['script_cloud_path'] = upload_to_gcs(script_path, os.path.basename(script_path),
+                                                   progress, stage='gcs_upload_script')
+    return paths
+
+# Upload a file from the models directory to gs://ptm_models/models/<name>
+# Large files go up as parallel composite uploads, and the result is
+# checksum-verified (see gcs_transfer.py). With background=True the upload
+# runs on a worker thread while the caller carries on; wait_for_uploads()
+# joins them. The returned gs:// path is known before the upload finishes.
+def upload_to_gcs(local_path, name, progress=None, stage='gcs_upload', background=None):
+    if progress is None:
+        progress = ProgressReporter()
+    if background is None:
+        background = BACKGROUND_UPLOAD
+    cloud_path = f"gs://ptm_models/models/{name}"
+
+    def run():
+        print(f"Uploading {local_path} to GCS...")
+        bucket = storage.Client().bucket('ptm_models')
+        # 5 MB chunks with up to 5 minutes each for small files
+        with progress.stage(stage):
+            gcs_transfer.upload(bucket, f"models/{name}", local_path,
+                                workers=GCS_TRANSFER_WORKERS, timeout=300)
+        print(f"Uploaded to {cloud_path}")
+
+    if background:
+        _pending_uploads.append(_upload_pool.submit(run))
+    else:
+        run()
+    return cloud_path
 
-    print("Uploading to GCS...")
-    client = storage.Client()
-    bucket = client.bucket('ptm_models')
-    blob = bucket.blob(f"models/{output_file}")
+# Block until every background upload is done; re-raises the first failure
+def wait_for_uploads():
+    while _pending_uploads:
+        _pending_uploads.pop(0).result()
 
-    # send in 5 MB chunks rather than one giant request
-    blob.chunk_size = 5 * 1024 * 1024  
+# Download gs://ptm_models/models/<name> to local_path, sliced and
+# checksum-verified (see gcs_transfer.py); False if it doesn't exist
+def download_from_gcs(name, local_path):
+    blob = storage.Client().bucket('ptm_models').get_blob(f"models/{name}")
+    if blob is None:
+        return False
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    gcs_transfer.download(blob, local_path, workers=GCS_TRANSFER_WORKERS)
+    print(f"Downloaded gs://ptm_models/models/{name} to {local_path}")
+    return True
 
-    # give it up to 5 minutes per chunk
-    blob.upload_from_filename(local_path, timeout=300)  
+# Delete gs://ptm_models/models/<name>; False if it didn't exist
+def delete_from_gcs(name):
+    blob = storage.Client().bucket('ptm_models').blob(f"models/{name}")
+    if not blob.exists():
+        return False
+    blob.delete()
+    print(f"Deleted gs://ptm_models/models/{name}")
+    return True
 
-    cloud_path = f"gs://ptm_models/models/{output_file}"
-    print(f"Uploaded to {cloud_path}")
-    return {'local_path': local_path, 'cloud_path': cloud_path}
+# Remove the artifacts with the given suffixes stored next to a model's
+# .pth, locally and in GCS, so they can't outlive the weights they came from
+def remove_artifacts(local_path, suffixes):
+    for suffix in suffixes:
+        path = sibling_path(local_path, suffix)
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"Removed stale {path}")
+        delete_from_gcs(os.path.basename(path))
+
+# Previous version of a model for incremental training: its .pth and the
+# manifest of images it was trained on, from the models directory or else
+# from GCS. Returns (None, None) when there is no previous model.
+def load_base_model(output_file, base_path=None):
+    base_path = base_path or os.path.join(os.path.dirname(__file__), 'models', output_file)
+    if not os.path.exists(base_path) and not download_from_gcs(os.path.basename(base_path), base_path):
+        return None, None
+    manifest_path = sibling_path(base_path, MANIFEST_SUFFIX)
+    if not os.path.exists(manifest_path):
+        download_from_gcs(os.path.basename(manifest_path), manifest_path)
+    return base_path, load_manifest(manifest_path)
+
+# Quantize the trained model to int8 and store it next to the .pth, locally
+# and in GCS. Half of a small random sample of the dataset calibrates the
+# activation ranges, the other half measures the accuracy delta vs fp32.
+# Samples go through the same decode/resize/crop as inference, so the
+# calibrated ranges match what the served model sees. Returns None when
+# too few images decode to do either.
+def save_quantized(model, arch, image_urls, paths, mode='static', progress=None, sample_size=64):
+    if progress is None:
+        progress = ProgressReporter()
+    # images are already in the local cache from training, so this is cheap
+    local_paths = prefetch_images(image_urls, ImageCache(DATASET_CACHE_DIR), workers=PREFETCH_WORKERS)
+    items = [(label, local_paths[url]) for label, urls in enumerate(image_urls.values())
+             for url in urls if url in local_paths]
+    samples = []
+    for label, path in random.sample(items, min(len(items), 2 * sample_size)):
+        try:
+            with open(path, 'rb') as f:
+                samples.append((preprocess_batch([f.read()])[0], label))
+        except Exception as e:
+            print(f"[ERROR] quantization sample {path}: {e}")
+    half = len(samples) // 2
+
+    def batches(items, bs=16):
+        return [(torch.stack([x for x, _ in items[i:i + bs]]), torch.tensor([y for _, y in items[i:i + bs]]))
+                for i in range(0, len(items), bs)]
+
+    calibration = [inputs for inputs, _ in batches(samples[:half])]
+    evaluation = batches(samples[half:])
+    if not calibration or not evaluation:
+        print(f"Only {len(samples)} images decoded, not enough to quantize")
+        return None
+    int8_path = sibling_path(paths['local_path'], INT8_SUFFIX)
+    report = quantize_and_save(model, arch, len(image_urls), calibration, evaluation, int8_path,
+                               sibling_path(paths['local_path'], INT8_REPORT_SUFFIX), mode=mode)
+    progress.emit('quantize', **report)
+    report['cloud_path'] = upload_to_gcs(int8_path, os.path.basename(int8_path), progress,
+                                         stage='gcs_upload_int8')
+    return report
+
+# Atomically write the job result (model paths) for the server to pick up
+def write_result(path, paths):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(paths, f)
+    os.replace(tmp_path, path)
 
 # Main execution
 if __name__ == '__main__':
     print('\n=== STARTING TRAINING SCRIPT ===')
     print('Args:', sys.argv)
-    if len(sys.argv) != 5:
-        print('Usage: python train_model.py <model_name> <classes> <arch> <output_file>')
-        sys.exit(1)
-    model_name, cls_str, arch, out = sys.argv[1:]
+    parser = argparse.ArgumentParser(usage='python train_model.py <model_name> <classes> <arch> <output_file> [options]')
+    parser.add_argument('model_name')
+    parser.add_argument('classes')
+    parser.add_argument('arch')
+    parser.add_argument('output_file')
+    parser.add_argument('--tensor-store', action='store_true',
+                        default=os.getenv('TRAIN_TENSOR_STORE', '') == '1',
+                        help='decode images once into a memory-mapped uint8 store')
+    parser.add_argument('--cached-features', action='store_true',
+                        help='compute frozen-backbone features once and train only the head on them')
+    parser.add_argument('--feature-augs', type=int, default=0,
+                        help='number of augmented feature views to cache (0 = no augmentation)')
+    parser.add_argument('--result-file',
+                        help='write the saved model paths to this JSON file')
+    parser.add_argument('--progress-file',
+                        help='append per-epoch/per-batch progress events to this NDJSON file')
+    parser.add_argument('--progress-every', type=int, default=10,
+                        help='emit a batch progress event every N batches (0 = epochs only)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='warm-start from the previous version of the model and fine-tune '
+                             'the head on new images plus a replay sample of old ones')
+    parser.add_argument('--base',
+                        help='previous .pth for --incremental (default: models/<output_file>, else GCS)')
+    parser.add_argument('--replay-ratio', type=float, default=0.2,
+                        help='fraction of already-trained images per class replayed by --incremental')
+    parser.add_argument('--max-epochs', type=int,
+                        help='stop after this many epochs (default: none, or 5 with --incremental)')
+    parser.add_argument('--refresh-listing', action='store_true',
+                        help='list every class in full instead of fetching only new uploads')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the last checkpoint of this output file, if any')
+    parser.add_argument('--checkpoint-every', type=int, default=1,
+                        help='write a checkpoint every N epochs (0 = never)')
+    parser.add_argument('--background-upload', action='store_true', default=BACKGROUND_UPLOAD,
+                        help='upload artifacts to GCS on background threads while the script carries on')
+    parser.add_argument('--no-export', action='store_true',
+                        help='skip the TorchScript export next to the .pth')
+    parser.add_argument('--quantize', choices=['static', 'dynamic'],
+                        default=os.getenv('TRAIN_QUANTIZE') or None,
+                        help='also save an int8 TorchScript model next to the .pth')
+    parser.add_argument('--sweep', action='store_true',
+                        help='train every --sweep-archs/--sweep-lrs/--sweep-batch-sizes combination '
+                             'in parallel on the same data and compare them, instead of saving a model')
+    parser.add_argument('--sweep-archs', default='',
+                        help='comma-separated architectures (default: <arch>)')
+    parser.add_argument('--sweep-lrs', default='0.001', help='comma-separated learning rates')
+    parser.add_argument('--sweep-batch-sizes', default='32', help='comma-separated batch sizes')
+    parser.add_argument('--sweep-workers', type=int,
+                        help='trials run at once (default: one per GPU, else a quarter of the cores)')
+    args = parser.parse_args()
+    BACKGROUND_UPLOAD = args.background_upload
+    model_name, cls_str, arch, out = args.model_name, args.classes, args.arch, args.output_file
     classes = eval(cls_str)
     print(f"Model: {model_name} | Classes: {classes} | Arch: {arch} | Out: {out} | Device: {device}")
+    progress = ProgressReporter(args.progress_file)
     try:
-        image_urls = get_image_urls_from_cloudinary(model_name, classes)
+        with progress.stage('cloudinary_listing'):
+            image_urls = get_image_urls_from_cloudinary(model_name, classes,
+                                                        force_full=args.refresh_listing)
         print('Fetched images')
     except Exception as e:
         print(f'ERROR fetching images: {e}'); sys.exit(1)
+    if args.sweep:
+        from sweep import run_sweep
+        try:
+            results = run_sweep(os.path.splitext(out)[0], image_urls,
+                                archs=[a for a in args.sweep_archs.split(',') if a] or [arch],
+                                lrs=[float(lr) for lr in args.sweep_lrs.split(',')],
+                                batch_sizes=[int(bs) for bs in args.sweep_batch_sizes.split(',')],
+                                workers=args.sweep_workers, max_epochs=args.max_epochs or 10,
+                                progress=progress)
+            if args.result_file:
+                write_result(args.result_file, {'sweep': results})
+        except Exception as e:
+            print(f'Fatal: {e}')
+            import traceback; traceback.print_exc()
+            sys.exit(1)
+        sys.exit(0)
     try:
-        model = setup_model(arch, len(classes))
+        base_path = manifest = None
+        if args.incremental:
+            base_path, manifest = load_base_model(out, args.base)
+            if base_path is None:
+                print('No previous model found, running a full training')
+            elif manifest is None:
+                # without it the head's class order, and the images it has
+                # already seen, are unknown
+                print(f'No training manifest for {base_path}, running a full training')
+                base_path = None
+            elif manifest.get('arch') != arch:
+                # its weights don't fit this architecture
+                print(f"{base_path} is a {manifest.get('arch')} model, not {arch}; running a full training")
+                base_path = None
+        train_urls = image_urls
+        max_epochs = args.max_epochs
+        with progress.stage('model_setup'):
+            if base_path:
+                # classes of the previous version, in its label order
+                old_classes = manifest['classes']
+                model = setup_model(arch, len(old_classes), pretrained=False)
+                model.load_state_dict(torch.load(base_path, map_location=device))
+                model = expand_head(model, old_classes, list(image_urls))
+            else:
+                model = setup_model(arch, len(classes))
+        if base_path:
+            new_urls, old_urls = diff_listing(manifest, image_urls)
+            # fixed seed: a resumed run must pick the same replay images
+            replay = replay_sample(old_urls, ratio=args.replay_ratio, seed=0)
+            train_urls = incremental_urls(image_urls, new_urls, replay)
+            n_new = sum(len(urls) for urls in new_urls.values())
+            n_replay = sum(len(urls) for urls in replay.values())
+            added_classes = [cls for cls in image_urls if cls not in old_classes]
+            progress.emit('incremental', base=base_path, new_images=n_new,
+                          replay_images=n_replay, new_classes=added_classes)
+            print(f'Incremental training from {base_path}: {n_new} new images, '
+                  f'{n_replay} replayed, new classes: {added_classes}')
+            if max_epochs is None:
+                max_epochs = 5
         criterion = nn.CrossEntropyLoss()
         optimizer = optim.Adam(model.parameters(), lr=0.001)
-        model = train_model(model, image_urls, criterion, optimizer)
-        paths = save_model(model, model_name, out)
+        checkpoint_path = os.path.join(CHECKPOINT_DIR, os.path.splitext(out)[0] + '.ckpt')
+        if base_path and n_new == 0 and not added_classes:
+            print('No new images since the previous version, keeping its weights')
+        else:
+            model = train_model(model, train_urls, criterion, optimizer,
+                                use_tensor_store=args.tensor_store,
+                                feature_augs=args.feature_augs if args.cached_features else None,
+                                progress=progress, progress_every=args.progress_every,
+                                max_epochs=max_epochs, checkpoint_path=checkpoint_path,
+                                checkpoint_every=args.checkpoint_every, resume=args.resume)
+        paths = save_model(model, model_name, out, progress=progress, export=not args.no_export)
         print(f'Model saved: {paths}')
-        with open('model_cloud_path.txt', 'w') as f:
-            f.write(paths['cloud_path'])
+        # record what this version was trained on for the next incremental run
+        manifest_path = save_manifest(sibling_path(paths['local_path'], MANIFEST_SUFFIX),
+                                      arch, image_urls)
+        upload_to_gcs(manifest_path, os.path.basename(manifest_path), progress,
+                      stage='gcs_upload_manifest')
+        paths['manifest_path'] = manifest_path
+        if args.quantize:
+            # the fp32 model is saved already; an int8 failure doesn't fail the job
+            try:
+                with progress.stage('quantize'):
+                    report = save_quantized(model, arch, image_urls, paths, mode=args.quantize,
+                                            progress=progress)
+            except Exception as e:
+                import traceback; traceback.print_exc()
+                report = None
+                progress.emit('quantize', error=str(e))
+            if report is None:
+                print('WARNING: no int8 model saved, serving falls back to fp32')
+            else:
+                paths['int8_path'] = report['path']
+                paths['int8_cloud_path'] = report['cloud_path']
+        # every upload, the int8 one included, must have landed before the
+        # result reports their paths
+        with progress.stage('upload_wait'):
+            wait_for_uploads()
+        # the model is safely saved, the checkpoint isn't needed any more
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        if args.result_file:
+            write_result(args.result_file, paths)
     except Exception as e:
         print(f'Fatal: {e}')
         import traceback; traceback.print_exc()
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import gcs_transfer
+
+
+# Split "gs://bucket/path/to/blob" into (bucket, blob name)
+def parse_gcs_uri(uri: str):
+    parts = uri.replace("gs://", "", 1).split("/")
+    bucket_name = parts[0]
+    blob_name = "/".join(parts[1:])
+    if not bucket_name or not blob_name:
+        raise ValueError(f"Invalid GCS path: {uri}")
+    return bucket_name, blob_name
+
+
+# Local, content-addressed cache of model weight files downloaded from GCS.
+#
+# Files are named after (bucket, blob, generation, md5), so a new upload of
+# the same blob lands in a new file and stale copies can never be served.
+# Within `ttl` seconds of the last validation a hit costs no network at all;
+# after that a single metadata request revalidates the generation. Blobs
+# found missing (e.g. a model without a .ts.pt export) are remembered as
+# absent for `ttl` seconds too, so optional artifacts cost no request on
+# every model load. Downloads stream to a temp file in the cache directory
+# and are renamed into place, and files are evicted least-recently-used
+# once the cache exceeds max_bytes.
+#
+# `client` can be any object exposing `bucket(name).get_blob(name)` the way
+# google.cloud.storage.Client does, which keeps this testable offline.
+class WeightCache:
+    def __init__(self, cache_dir: str, max_bytes: int = 4 * 1024 ** 3,
+                 ttl: float = 300.0, client=None, transfer_workers: int = 8):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+        self._client = client
+        self.transfer_workers = int(transfer_workers)
+        self._lock = threading.Lock()
+        self._uri_locks = {}
+        self._index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._read_index()
+        self._absent = {}  # uri -> time it was found missing
+        self.hits = 0
+        self.absent_hits = 0
+        self.revalidated = 0
+        self.downloads = 0
+        self.evictions = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import storage
+            self._client = storage.Client()
+        return self._client
+
+    # Return a local file path holding the current contents of `uri`.
+    # Raises FileNotFoundError if the blob does not exist.
+    def fetch(self, uri: str) -> str:
+        with self._lock:
+            uri_lock = self._uri_locks.setdefault(uri, threading.Lock())
+        with uri_lock:
+            return self._fetch(uri)
+
+    def _fetch(self, uri: str) -> str:
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(uri)
+            if entry and now - entry["checked_at"] < self.ttl:
+                path = self._path(entry["file"])
+                if os.path.exists(path):
+                    entry["used_at"] = now
+                    self.hits += 1
+                    return path
+            missing_at = self._absent.get(uri)
+            if missing_at is not None and now - missing_at < self.ttl:
+                self.absent_hits += 1
+                raise FileNotFoundError(f"Blob not found: {uri}")
+
+        bucket_name, blob_name = parse_gcs_uri(uri)
+        blob = self.client.bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            with self._lock:
+                self._absent[uri] = now
+            raise FileNotFoundError(f"Blob not found: {uri}")
+
+        file_name = self._file_name(bucket_name, blob_name, blob.generation, blob.md5_hash)
+        path = self._path(file_name)
+        if os.path.exists(path):
+            with self._lock:
+                self.revalidated += 1
+        else:
+            self._download(blob, path)
+            with self._lock:
+                self.downloads += 1
+
+        with self._lock:
+            self._absent.pop(uri, None)
+            old = self._index.get(uri)
+            if old and old["file"] != file_name:
+                self._remove_file(old["file"])
+            self._index[uri] = {
+                "file": file_name,
+                "generation": blob.generation,
+                "md5": blob.md5_hash,
+                "size": os.path.getsize(path),
+                "checked_at": now,
+                "used_at": now,
+            }
+            self._evict(keep=uri)
+            self._write_index()
+        return path
+
+    # Download the blob (in parallel slices when large, checksum-verified)
+    # into a temp file next to its final location, then atomically rename
+    # it so readers never see a partial file
+    def _download(self, blob, path: str):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        os.close(fd)
+        try:
+            gcs_transfer.download(blob, tmp_path, workers=self.transfer_workers)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _evict(self, keep: str):
+        total = sum(e["size"] for e in self._index.values())
+        for uri, entry in sorted(self._index.items(), key=lambda kv: kv[1]["used_at"]):
+            if total <= self.max_bytes:
+                break
+            if uri == keep:
+                continue
+            self._remove_file(entry["file"])
+            del self._index[uri]
+            total -= entry["size"]
+            self.evictions += 1
+
+    def invalidate(self, uri: str):
+        with self._lock:
+            self._absent.pop(uri, None)
+            entry = self._index.pop(uri, None)
+            if entry:
+                self._remove_file(entry["file"])
+                self._write_index()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": sum(e["size"] for e in self._index.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "absent": len(self._absent),
+                "absent_hits": self.absent_hits,
+                "revalidated": self.revalidated,
+                "downloads": self.downloads,
+                "evictions": self.evictions,
+            }
+
+    @staticmethod
+    def _file_name(bucket_name, blob_name, generation, md5_hash) -> str:
+        ident = f"{bucket_name}/{blob_name}#{generation}:{md5_hash}"
+        ext = os.path.splitext(blob_name)[1]
+        return hashlib.sha256(ident.encode("utf-8")).hexdigest() + ext
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.cache_dir, file_name)
+
+    def _remove_file(self, file_name: str):
+        try:
+            os.remove(self._path(file_name))
+        except FileNotFoundError:
+            pass
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self._index_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)